@@ -4,5 +4,16 @@ Python codegen, somewhere between gluing strings together and `ast`
 """
 
 from .text import *
-from . import codegen
-from . import experimental
\ No newline at end of file
+
+# Submodules that are only imported when first accessed (`indented.codegen`),
+# so that `import indented` stays cheap.
+_lazy_submodules = ('codegen', 'incremental', 'intern', 'template', 'instrument', 'rope', 'astgen', 'importer', 'experimental')
+
+def __getattr__(name: str):
+	if name in _lazy_submodules:
+		import importlib
+		return importlib.import_module('.' + name, __name__) # also sets it as an attribute of this package
+	raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+def __dir__():
+	return sorted(set(globals()) | set(_lazy_submodules))
@@ -0,0 +1,227 @@
+"""
+An `ast` backend for the statement helpers of `indented.codegen`.
+
+The text path to a function is: build a tree, `flatten_tree` it, then `eval_def`
+has Python tokenize and parse it all over again. The helpers in this module build
+`ast` nodes instead, which get compiled directly - no rendering and no parsing.
+They mirror the `codegen` ones, except that statements take their bodies as arguments:
+
+>>> f = compile_def(def_('sign', ['x'], [
+...     *cond([
+...         when(compare(name('x'), '>', lit(0)), [return_(lit(1))]),
+...         when('x < 0', ['return -1']), # strings get parsed (and the results cached)
+...     ], default=['return 0']),
+... ]))
+>>> f(5), f(-5), f(0)
+(1, -1, 0)
+>>> compile_def(def_('k', ['x'], [return_(apply('dict', [], {'a': 'x'}))]))(1)
+{'a': 1}
+
+For debugging, the nodes can be turned back into text:
+
+>>> print(to_source(def_('f', ['x', 'y=1'], [for_('i', apply('range', ['y']), ['x += i']), return_('x')])))
+def f(x, y=1):
+    for i in range(y):
+        x += i
+    return x
+
+Strings are parsed once and the resulting nodes are shared, so don't modify the nodes in place.
+All the nodes are at line 1, so tracebacks from the compiled code aren't very informative -
+if that matters, compile `to_source(node)` with `codegen.eval_def` instead.
+"""
+
+import ast
+from functools import lru_cache
+
+from .codegen import when
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+
+Expr = 'Union[str, ast.expr]'
+Stmt = 'Union[str, ast.stmt]'
+Body = 'Iterable[Union[Stmt, Iterable[Stmt]]]'
+
+_LOAD  = ast.Load()
+_STORE = ast.Store()
+
+
+def _at(node: ast.AST) -> ast.AST:
+	"Gives `node` a location, so it can be compiled without going through `ast.fix_missing_locations`."
+	node.lineno = 1
+	node.col_offset = 0
+	return node
+
+
+# Parsing strings
+
+@lru_cache(maxsize=4096)
+def _parse_expr(src: str) -> ast.expr:
+	return ast.parse(src, mode='eval').body
+
+@lru_cache(maxsize=4096)
+def _parse_stmts(src: str) -> 'Tuple[ast.stmt, ...]':
+	return tuple(ast.parse(src).body)
+
+@lru_cache(maxsize=1024)
+def _parse_params(params: 'Tuple[str, ...]') -> ast.arguments:
+	return ast.parse('def f({}): pass'.format(', '.join(params))).body[0].args
+
+@lru_cache(maxsize=1024)
+def _parse_target(src: str) -> ast.expr:
+	return ast.parse('{} = None'.format(src)).body[0].targets[0]
+
+def expr(x: Expr) -> ast.expr:
+	"Returns `x` if it's already a node, otherwise parses it."
+	return _parse_expr(x) if type(x) is str else x
+
+def target(x: Expr) -> ast.expr:
+	"Like `expr`, but for assignment targets (`for` loop variables, `with ... as` names)."
+	return _parse_target(x) if type(x) is str else x
+
+def stmts(body: Body) -> 'List[ast.stmt]':
+	"Turns a body into a list of statements. Strings get parsed, nested lists get splatted."
+	out = []
+	for item in body:
+		if type(item) is str:
+			out.extend(_parse_stmts(item))
+		elif isinstance(item, ast.stmt):
+			out.append(item)
+		elif isinstance(item, (list, tuple)):
+			out.extend(stmts(item))
+		else:
+			raise TypeError('Expected a statement (str or ast.stmt), got {!r}: {!r}'.format(type(item).__qualname__, item))
+	if not out:
+		out.append(_at(ast.Pass()))
+	return out
+
+
+
+# Expressions
+
+name = lambda id: _at(ast.Name(id, _LOAD))
+
+def lit(value: Any) -> ast.expr:
+	if value is None or value is ... or type(value) in (bool, int, float, complex, str, bytes):
+		return _at(ast.Constant(value))
+	return _parse_expr(repr(value))
+
+attr = lambda target, attr: _at(ast.Attribute(expr(target), attr, _LOAD))
+item = lambda target, index: _at(ast.Subscript(expr(target), expr(index), _LOAD))
+
+def apply(func: Expr, args: 'Optional[List[Expr]]' = None, kwargs: 'Union[None, List[Tuple[str, Expr]], Dict[str, Expr]]' = None) -> ast.Call:
+	if isinstance(kwargs, dict):
+		kwargs = kwargs.items()
+	return _at(ast.Call(
+		expr(func),
+		[expr(arg) for arg in args] if args else [],
+		[_at(ast.keyword(key, expr(val))) for (key, val) in kwargs] if kwargs else [],
+	))
+
+method = lambda target, method, args: apply(attr(target, method), args)
+
+tuple_ = lambda exprs: _at(ast.Tuple([expr(x) for x in exprs], _LOAD))
+list_  = lambda exprs: _at(ast.List([expr(x) for x in exprs], _LOAD))
+
+_COMPARISON_OPS = {
+	'==': ast.Eq(), '!=': ast.NotEq(), '<': ast.Lt(), '<=': ast.LtE(), '>': ast.Gt(), '>=': ast.GtE(),
+	'is': ast.Is(), 'is not': ast.IsNot(), 'in': ast.In(), 'not in': ast.NotIn(),
+}
+
+def compare(left: Expr, op: str, right: Expr) -> ast.Compare:
+	return _at(ast.Compare(expr(left), [_COMPARISON_OPS[op]], [expr(right)]))
+
+_BINARY_OPS = {
+	'+': ast.Add(), '-': ast.Sub(), '*': ast.Mult(), '/': ast.Div(), '//': ast.FloorDiv(), '%': ast.Mod(), '**': ast.Pow(),
+	'<<': ast.LShift(), '>>': ast.RShift(), '|': ast.BitOr(), '&': ast.BitAnd(), '^': ast.BitXor(), '@': ast.MatMult(),
+}
+
+def binop(left: Expr, op: str, right: Expr) -> ast.BinOp:
+	return _at(ast.BinOp(expr(left), _BINARY_OPS[op], expr(right)))
+
+
+
+# Statements
+
+return_ = lambda value=None: _at(ast.Return(expr(value) if value is not None else None))
+assign  = lambda target_, value: _at(ast.Assign([target(target_)], expr(value)))
+pass_   = lambda: _at(ast.Pass())
+
+def def_(name: str, args: 'List[str]', body: Body) -> ast.FunctionDef:
+	return _at(ast.FunctionDef(name, _parse_params(tuple(args)), stmts(body), [], None))
+
+def if_(test: Expr, body: Body, orelse: 'Optional[Body]' = None) -> ast.If:
+	return _at(ast.If(expr(test), stmts(body), stmts(orelse) if orelse is not None else []))
+
+def for_(pat: Expr, iterable: Expr, body: Body, orelse: 'Optional[Body]' = None) -> ast.For:
+	return _at(ast.For(target(pat), expr(iterable), stmts(body), stmts(orelse) if orelse is not None else []))
+
+def with_(context: Expr, pat: 'Optional[Expr]', body: Body) -> ast.With:
+	return _at(ast.With([ast.withitem(expr(context), target(pat) if pat is not None else None)], stmts(body)))
+
+def except_(exc_type: 'Optional[Expr]', exc_name: 'Optional[str]', body: Body) -> ast.ExceptHandler:
+	return _at(ast.ExceptHandler(expr(exc_type) if exc_type is not None else None, exc_name, stmts(body)))
+
+def try_(body: Body, handlers: 'List[ast.ExceptHandler]' = (), orelse: 'Optional[Body]' = None, finalbody: 'Optional[Body]' = None) -> ast.Try:
+	assert handlers or finalbody is not None, 'A try needs at least one except or a finally'
+	return _at(ast.Try(
+		stmts(body), list(handlers),
+		stmts(orelse) if orelse is not None else [],
+		stmts(finalbody) if finalbody is not None else [],
+	))
+
+
+def cond(cases_and_bodies: 'List[Tuple[Expr, Body]]', default: 'Optional[Body]' = None, allow_zero_cases: bool = False) -> 'List[ast.stmt]':
+	"""
+	Like `codegen.cond`: an if-elif-else chain, returned as a list of statements to splat into a body.
+	"""
+	assert isinstance(cases_and_bodies, list)
+
+	if cases_and_bodies:
+		orelse = stmts(default) if default is not None else []
+		# `elif`s are nested `if`s in the `orelse` of the previous one, so build it inside out
+		for (test, body) in reversed(cases_and_bodies):
+			orelse = [_at(ast.If(expr(test), stmts(body), orelse))]
+		return orelse
+
+	elif allow_zero_cases:
+		if default is not None:
+			return stmts(default)
+		else:
+			raise ValueError('cond() called without any branches')
+
+	else:
+		raise ValueError('`cond()` expects at least 1 if-branch.\n(pass `allow_zero_cases=True` to suppress this error and inline `else_body` instead) ')
+
+
+
+# Compiling and rendering
+
+def compile_defs(defs: 'Iterable[ast.stmt]', filename: str = '<astgen>') -> 'Dict[str, Callable]':
+	"Compiles function definitions (in one module) and returns a dict mapping their names to the functions."
+	namespace = {}
+	exec(compile(ast.Module(list(defs), []), filename, 'exec', dont_inherit=True), {}, namespace)
+	return namespace
+
+def compile_def(definition: ast.stmt, filename: str = '<astgen>') -> Callable:
+	"Like `codegen.eval_def`, but for a `def_` node."
+	(func,) = compile_defs([definition], filename).values()
+	return func
+
+def to_source(node_or_nodes: 'Union[ast.AST, List[ast.stmt]]') -> str:
+	"Renders nodes back to text, with `ast.unparse`."
+	if isinstance(node_or_nodes, list):
+		node_or_nodes = ast.Module(node_or_nodes, [])
+	return ast.unparse(node_or_nodes)
+
+
+
+# Change the names of lambdas from '<lambda>' to however
+# they're called in this module for better error messages
+
+func = type(lambda: None)
+n, v = None, None # prevent creating new variables (n, v) during loop, which messes up dict iteration
+for n, v in globals().items():
+	if type(v) is func and v.__name__ == '<lambda>':
+		v.__name__     = n
+		v.__qualname__ = n
@@ -0,0 +1,85 @@
+"""
+Benchmarks for `indented`.
+They're not imported by the package itself, run them with the runner:
+
+	python -m indented.benchmarks [--filter SUBSTRING] [--json results.json] [--compare baseline.json]
+
+(see `python -m indented.benchmarks --help`)
+
+A benchmark is a function registered with `@benchmark(param=[values...], ...)`.
+It gets called once for every combination of the parameters,
+does its setup and returns a zero-argument callable, which is what gets timed.
+Benchmarks that measure something other than run time (`timed=False`)
+return a dict of metrics instead.
+"""
+
+import itertools
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple
+
+from ..text import Tree, iter_lines_with_indent_level
+
+
+# The modules containing the benchmarks, in the order they're run
+BENCHMARK_MODULES = (
+	'bench_text',
+	'bench_codegen',
+	'import_time',
+)
+
+
+class Benchmark(NamedTuple):
+	name: str
+	func: 'Callable[..., Any]'
+	params: 'Dict[str, List[Any]]'
+	timed: bool
+
+	def param_combinations(self) -> 'Iterator[Dict[str, Any]]':
+		names = list(self.params)
+		for values in itertools.product(*(self.params[name] for name in names)):
+			yield dict(zip(names, values))
+
+
+registry = [] # type: List[Benchmark]
+
+def benchmark(timed: bool = True, **params: 'List[Any]') -> 'Callable[[Callable], Callable]':
+	def register(func):
+		module = func.__module__.rpartition('.')[2]
+		registry.append(Benchmark(module+'.'+func.__name__, func, params, timed))
+		return func
+	return register
+
+
+
+# Test data
+
+def make_line(i: int, line_length: int) -> str:
+	line = 'x_{} = f({})'.format(i, i)
+	return (line + ' ' + 'y' * line_length)[:line_length] if len(line) < line_length else line
+
+def make_tree(width: int, depth: int, line_length: int = 40) -> Tree:
+	"""
+	A balanced tree: a block of `width` lines, each of them followed by
+	a nested block of the same shape, `depth` levels deep (so ~`width**depth` lines).
+	"""
+	counter = itertools.count()
+	def block(depth: int) -> Tree:
+		nodes = []
+		for _ in range(width):
+			nodes.append(make_line(next(counter), line_length))
+			if depth > 1:
+				nodes.append(block(depth-1))
+		return nodes
+	return block(depth)
+
+def make_deep_tree(depth: int, width: int = 1, line_length: int = 40) -> Tree:
+	"A tree that's just `depth` nested blocks, each with `width` lines before the nested one."
+	tree = []
+	block = tree
+	for d in range(depth):
+		block.extend(make_line(d * width + i, line_length) for i in range(width))
+		inner = []
+		block.append(inner)
+		block = inner
+	return tree
+
+count_lines = lambda tree: sum(1 for _ in iter_lines_with_indent_level(tree))
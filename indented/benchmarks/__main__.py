@@ -0,0 +1,99 @@
+"""
+Runs the benchmarks and optionally saves the results as JSON
+or compares them with previously saved ones.
+
+	python -m indented.benchmarks --json before.json
+	# ...upgrade or change something...
+	python -m indented.benchmarks --compare before.json
+"""
+
+import argparse
+import importlib
+import json
+import platform
+import sys
+import timeit
+
+from typing import Any, Dict, List
+
+from . import BENCHMARK_MODULES, Benchmark, registry
+
+
+def run_benchmark(bench: Benchmark, params: 'Dict[str, Any]', repeat: int) -> 'Dict[str, float]':
+	if not bench.timed:
+		return bench.func(**params)
+	timer = timeit.Timer(bench.func(**params))
+	(number, _) = timer.autorange()
+	best = min(timer.repeat(repeat=repeat, number=number)) / number
+	return {'seconds': best}
+
+
+def result_key(result: 'Dict[str, Any]') -> str:
+	return result['benchmark'] + json.dumps(result['params'], sort_keys=True)
+
+def format_params(params: 'Dict[str, Any]') -> str:
+	return str.join(', ', ('{}={}'.format(name, value) for (name, value) in params.items()))
+
+def format_metrics(metrics: 'Dict[str, float]') -> str:
+	return str.join(', ', (
+		'{:.3f} usec'.format(value * 1e6) if name == 'seconds' else '{}={:g}'.format(name, value)
+		for (name, value) in metrics.items()
+	))
+
+
+def main(argv=None) -> int:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--filter', '-k', action='append', default=[], help='only run benchmarks whose name contains this substring (can be repeated)')
+	parser.add_argument('--repeat', type=int, default=5, help='timing repetitions (the best one is reported)')
+	parser.add_argument('--json', metavar='PATH', help='save the results to this file')
+	parser.add_argument('--compare', metavar='PATH', help='compare the results with ones saved earlier with --json')
+	parser.add_argument('--threshold', type=float, default=0.10, help='relative slowdown reported as a regression (default: %(default)s)')
+	args = parser.parse_args(argv)
+
+	for module in BENCHMARK_MODULES:
+		importlib.import_module('.'+module, __package__)
+
+	baseline = {}
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = {result_key(result): result for result in json.load(f)['results']}
+
+	results = [] # type: List[Dict[str, Any]]
+	regressions = 0
+	for bench in registry:
+		if args.filter and not any(pattern in bench.name for pattern in args.filter):
+			continue
+		for params in bench.param_combinations():
+			metrics = run_benchmark(bench, params, args.repeat)
+			result = {'benchmark': bench.name, 'params': params, 'metrics': metrics}
+			results.append(result)
+
+			comparison = ''
+			old = baseline.get(result_key(result))
+			if old is not None:
+				ratios = {
+					name: value / old['metrics'][name]
+					for (name, value) in metrics.items() if old['metrics'].get(name)
+				}
+				comparison = '  ' + str.join(', ', ('x{:.2f}'.format(ratio) for ratio in ratios.values()))
+				if any(ratio > 1 + args.threshold for ratio in ratios.values()):
+					regressions += 1
+					comparison += '  REGRESSION'
+			print('{}[{}]:  {}{}'.format(bench.name, format_params(params), format_metrics(metrics), comparison), flush=True)
+
+	if args.json:
+		with open(args.json, 'w') as f:
+			json.dump({
+				'python': sys.version,
+				'implementation': platform.python_implementation(),
+				'results': results,
+			}, f, indent=1)
+
+	if regressions:
+		print('\n{} regression(s) above {:.0%}'.format(regressions, args.threshold))
+		return 1
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,284 @@
+"""
+Benchmarks for the `indented.codegen` helpers, `eval_def` and the code generated by `switch`.
+"""
+
+import importlib
+import itertools
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+from . import benchmark
+from ..text import Tree, TextBuilder, flatten_tree, count_lines
+from ..intern import Interner
+from ..template import Template, splice
+from ..importer import GeneratedModuleFinder
+from ..codegen import (
+	apply, tuple_, params_str, cond, when, lit, item, ConstPool,
+	def_, switch, eval_def, eval_defs, CodeCache,
+	def_block, cond_into,
+)
+
+
+@benchmark(n_args=[2, 20])
+def apply_(n_args):
+	args   = ['arg_{}'.format(i) for i in range(n_args)]
+	kwargs = [('kw_{}'.format(i), lit(i)) for i in range(n_args)]
+	return lambda: apply('some_function', args, kwargs)
+
+
+@benchmark(n_args=[2, 20])
+def params_str_(n_args):
+	args   = ['arg_{}'.format(i) for i in range(n_args)]
+	kwargs = {'kw_{}'.format(i): lit(i) for i in range(n_args)}
+	return lambda: params_str(args, kwargs)
+
+
+@benchmark(n_exprs=[1, 20])
+def tuple__(n_exprs):
+	exprs = ['expr_{}'.format(i) for i in range(n_exprs)]
+	return lambda: tuple_(exprs)
+
+
+@benchmark(n_cases=[4, 64])
+def cond_(n_cases):
+	cases = [(('x == '+lit(i)), ['return '+lit(i)]) for i in range(n_cases)]
+	return lambda: cond([when(test, body) for (test, body) in cases], ['return None'])
+
+
+def _function_source(n_cases: int) -> str:
+	return flatten_tree([
+		def_('f', ['x']), cond(
+			[when('x == '+lit(i), ['y = x * {}'.format(i), 'return y']) for i in range(n_cases)],
+			['return None'],
+		),
+	])
+
+@benchmark(n_cases=[4, 64], cached=[False, True])
+def eval_def_(n_cases, cached):
+	src = _function_source(n_cases)
+	cache = CodeCache() if cached else None
+	return lambda: eval_def(src, cache=cache)
+
+
+# `switch`: how long the generated dispatcher takes to go through all of its keys
+
+def _dispatcher(n_keys: int, keys: str, strategy: str, bodies: str):
+	step = 1 if keys == 'dense' else 7
+	key_values = [i * step for i in range(n_keys)]
+	cases = {
+		key: (['return '+lit(key)] if bodies == 'literal' else ['y = x + 1', 'return y'])
+		for key in key_values
+	}
+	f = eval_def(flatten_tree([def_('f', ['x']), switch('x', cases, default=['return None'], strategy=strategy, typed_keys=True)]), cache=None)
+	return (f, key_values)
+
+@benchmark(n_keys=[4, 16, 64], keys=['dense', 'sparse'], strategy=['linear', 'binary', 'hybrid', 'auto'])
+def switch_dispatch(n_keys, keys, strategy):
+	(f, key_values) = _dispatcher(n_keys, keys, strategy, bodies='statements')
+	def run():
+		for key in key_values:
+			f(key)
+	return run
+
+@benchmark(n_keys=[4, 16, 64], strategy=['linear', 'hybrid', 'table'])
+def switch_dispatch_table(n_keys, strategy):
+	(f, key_values) = _dispatcher(n_keys, 'dense', strategy, bodies='literal')
+	def run():
+		for key in key_values:
+			f(key)
+	return run
+
+
+# Memory held by a big, repetitive `cond`-heavy tree, built plainly or through an `Interner`
+
+def _cond_heavy_tree(n_methods: int, intern) -> Tree:
+	tree = []
+	for m in range(n_methods):
+		cases = [
+			when('op == '+lit(i % 16), intern(['self.value = self.value ' + '+-*/'[i % 4] + ' ' + lit(i % 3), 'return self']))
+			for i in range(32)
+		]
+		tree.append(def_('method_{}'.format(m), ['self', 'op']))
+		tree.append(intern(cond(cases, ['raise ValueError(op)'])))
+	return tree
+
+@benchmark(timed=False, n_methods=[100, 1000], impl=['plain', 'interned'])
+def cond_tree_memory(n_methods, impl):
+	tracemalloc.start()
+	try:
+		intern = (lambda block: block) if impl == 'plain' else Interner()
+		tree = _cond_heavy_tree(n_methods, intern)
+		(current, peak) = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+	return {'retained_bytes': current, 'peak_bytes': peak, 'lines': count_lines(tree)}
+
+
+# Generating the same shape of class many times: rebuilding the tree vs a precompiled `Template`
+
+def _record_class_tree(name: str, fields: 'List[str]') -> Tree:
+	return [
+		'class {}:'.format(name), [
+			def_('__init__', ['self', *fields]), [
+				'self.' + field + ' = ' + field for field in fields
+			],
+			def_('__repr__', ['self']), [
+				'return ' + apply(lit(name + '({})') + '.format', ['self.' + field for field in fields]),
+			],
+		],
+	]
+
+_record_class_template = lambda: Template([
+	'class $name:', [
+		'def __init__(self, $params):', [
+			splice('assignments'),
+		],
+		'def __repr__(self):', [
+			'return $repr_format.format($field_values)',
+		],
+	],
+])
+
+@benchmark(n_fields=[2, 10], impl=['rebuild', 'template'])
+def record_class(n_fields, impl):
+	fields = ['field_{}'.format(i) for i in range(n_fields)]
+	if impl == 'rebuild':
+		return lambda: flatten_tree(_record_class_tree('Record', fields))
+	else:
+		render = _record_class_template().render
+		return lambda: render(
+			name='Record',
+			params=', '.join(fields),
+			assignments=['self.' + field + ' = ' + field for field in fields],
+			repr_format=lit('Record({})'),
+			field_values=', '.join('self.' + field for field in fields),
+		)
+
+
+# Building (and rendering) a module of `cond`-heavy functions: nested lists vs a `TextBuilder`
+
+@benchmark(n_functions=[10, 100], impl=['nested', 'builder'])
+def build_module(n_functions, impl):
+	cases = [('x == '+lit(i), ['y = x * '+lit(i), 'return y']) for i in range(16)]
+	if impl == 'nested':
+		def run():
+			tree = []
+			for f in range(n_functions):
+				tree.append(def_('f_{}'.format(f), ['x']))
+				tree.append(['x = abs(x)', *cond([when(test, body) for (test, body) in cases], ['return None'])])
+			return flatten_tree(tree)
+	else:
+		def run():
+			b = TextBuilder()
+			for f in range(n_functions):
+				with def_block(b, 'f_{}'.format(f), ['x']):
+					b.line('x = abs(x)')
+					cond_into(b, [when(test, body) for (test, body) in cases], ['return None'])
+			return b.flatten()
+	return run
+
+
+# Deeply nested expressions: the string helpers copy the inner parts at every level, the rope ones don't
+
+def _nested_call(helpers, depth: int) -> str:
+	expr = 'x'
+	for i in range(depth):
+		expr = helpers.method(helpers.attr('self', 'obj_{}'.format(i)), 'combine', [expr, helpers.item('table', helpers.tuple_(['i', 'j']))])
+	return str(expr)
+
+@benchmark(depth=[10, 100, 1000, 5000], impl=['str', 'rope'])
+def nested_expr(depth, impl):
+	from .. import codegen, rope
+	helpers = codegen if impl == 'str' else rope
+	return lambda: _nested_call(helpers, depth)
+
+
+# From generator code to function objects: text (render, then parse again) vs building `ast` nodes.
+# 'ast_strings' passes the same strings as the text version, which `astgen` parses (and caches).
+
+@benchmark(n_functions=[1, 50], impl=['text', 'ast', 'ast_strings'])
+def compile_functions(n_functions, impl):
+	from .. import astgen
+	n_cases = 16
+	if impl == 'text':
+		def run():
+			return eval_defs([
+				[def_('f_{}'.format(f), ['x']), cond(
+					[when('x == '+lit(i), ['y = x * '+lit(i), 'return y']) for i in range(n_cases)],
+					['return None'],
+				)]
+				for f in range(n_functions)
+			], cache=None)
+	elif impl == 'ast':
+		def run():
+			x = astgen.name('x')
+			return astgen.compile_defs([
+				astgen.def_('f_{}'.format(f), ['x'], astgen.cond(
+					[when(astgen.compare(x, '==', astgen.lit(i)), [
+						astgen.assign('y', astgen.binop(x, '*', astgen.lit(i))),
+						astgen.return_(astgen.name('y')),
+					]) for i in range(n_cases)],
+					[astgen.return_()],
+				))
+				for f in range(n_functions)
+			])
+	else:
+		def run():
+			return astgen.compile_defs([
+				astgen.def_('f_{}'.format(f), ['x'], astgen.cond(
+					[when('x == '+lit(i), ['y = x * '+lit(i), 'return y']) for i in range(n_cases)],
+					['return None'],
+				))
+				for f in range(n_functions)
+			])
+	return run
+
+
+# A table-driven function: the table inlined with `lit`, or passed by reference through a `ConstPool`
+
+@benchmark(table_size=[10, 1000, 10000], impl=['lit', 'const_pool'])
+def table_function(table_size, impl):
+	table = {'key_{}'.format(i): (i, i * 2, str(i)) for i in range(table_size)}
+	def run():
+		pool = ConstPool() if impl == 'const_pool' else None
+		table_expr = pool.lit(table) if pool is not None else lit(table)
+		src = flatten_tree([def_('lookup', ['key']), ['return ' + item(table_expr, 'key')]])
+		return eval_def(src, cache=None, namespace=pool.namespace if pool is not None else None)
+	return run
+
+
+# Importing a generated module: generated, rendered and compiled (cold),
+# or loaded from the `GeneratedModuleFinder`'s cache (warm).
+# Timed here rather than by the runner, so that the cache directory can be removed afterwards.
+
+@benchmark(timed=False, n_functions=[10, 100], cache=['cold', 'warm'])
+def generated_module(n_functions, cache):
+	n_cases = 16
+	def generate():
+		tree = []
+		for f in range(n_functions):
+			tree.append(def_('f_{}'.format(f), ['x']))
+			tree.append(cond(
+				[when('x == '+lit(i), ['y = x * '+lit(i), 'return y']) for i in range(n_cases)],
+				['return None'],
+			))
+		return tree
+	fullname = '_indented_bench_generated_{}'.format(n_functions)
+	versions = itertools.count()
+	with tempfile.TemporaryDirectory(prefix='indented-bench-') as cache_dir:
+		finder = GeneratedModuleFinder(cache_dir)
+		def run():
+			# a new key for every cold run, so it always misses
+			finder.register(fullname, generate, key=next(versions) if cache == 'cold' else 'v1')
+			sys.modules.pop(fullname, None)
+			with finder.installed():
+				return importlib.import_module(fullname)
+		if cache == 'warm':
+			run()
+		timer = timeit.Timer(run)
+		(number, _) = timer.autorange()
+		seconds = min(timer.repeat(repeat=5, number=number)) / number
+		sys.modules.pop(fullname, None)
+	return {'seconds': seconds}
@@ -0,0 +1,153 @@
+"""
+Benchmarks for rendering trees with `indented.text`.
+"""
+
+import tracemalloc
+
+from . import benchmark, make_tree, make_deep_tree
+from .. import text
+from ..text import flatten_tree, iter_lines_with_indent_level, indented_lines, indented_lines_rec
+
+
+SHAPES = dict(width=[10], depth=[2, 4], line_length=[20, 80])
+
+
+@benchmark(**SHAPES)
+def flatten(width, depth, line_length):
+	tree = make_tree(width, depth, line_length)
+	return lambda: flatten_tree(tree)
+
+
+@benchmark(**SHAPES)
+def iter_lines(width, depth, line_length):
+	tree = make_tree(width, depth, line_length)
+	def run():
+		for _ in iter_lines_with_indent_level(tree):
+			pass
+	return run
+
+
+@benchmark(**SHAPES)
+def lines_rec(width, depth, line_length):
+	tree = make_tree(width, depth, line_length)
+	return lambda: indented_lines_rec(tree)
+
+
+# The "recursive" and iterative versions on extreme shapes
+
+EXTREME_SHAPES = {
+	'deep': lambda: make_deep_tree(depth=2000, width=2),
+	'wide': lambda: make_tree(width=4000, depth=1),
+}
+
+@benchmark(shape=list(EXTREME_SHAPES), impl=['rec', 'iter'])
+def rec_vs_iter(shape, impl):
+	tree = EXTREME_SHAPES[shape]()
+	if impl == 'rec':
+		return lambda: indented_lines_rec(tree)
+	else:
+		return lambda: indented_lines(tree)
+
+
+# Serial vs parallel rendering of a module made of many independent classes.
+# The parallel version pays for starting the workers and sending the results back,
+# so it only wins above some size (which depends on the number of cores).
+
+@benchmark(n_classes=[10, 100, 1000, 5000], impl=['serial', 'parallel'])
+def flatten_parallel(n_classes, impl):
+	tree = []
+	for i in range(n_classes):
+		tree.append('class C{}:'.format(i))
+		tree.append(make_tree(width=5, depth=3))
+	if impl == 'serial':
+		return lambda: flatten_tree(tree)
+	else:
+		return lambda: text.flatten_parallel(tree)
+
+
+@benchmark(**SHAPES, impl=['flatten_encode', 'render_bytes'])
+def to_bytes(width, depth, line_length, impl):
+	tree = make_tree(width, depth, line_length)
+	if impl == 'flatten_encode':
+		return lambda: flatten_tree(tree).encode('utf-8')
+	else:
+		return lambda: text.render_bytes(tree)
+
+@benchmark(timed=False, **SHAPES, impl=['flatten_encode', 'render_bytes'])
+def to_bytes_memory(width, depth, line_length, impl):
+	tree = make_tree(width, depth, line_length)
+	render = (lambda: flatten_tree(tree).encode('utf-8')) if impl == 'flatten_encode' else (lambda: text.render_bytes(tree))
+	tracemalloc.start()
+	try:
+		render()
+		(_, peak) = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+	return {'peak_bytes': peak}
+
+
+# Re-rendering after a one-line change to a single block, from scratch vs incrementally.
+# ('incremental' only updates its list of lines, it doesn't join them into one string.)
+
+@benchmark(width=[10, 30], depth=[3], impl=['full', 'incremental'])
+def edit_one_line(width, depth, impl):
+	from ..incremental import LiveText
+	tree = make_tree(width, depth)
+	if impl == 'full':
+		def run():
+			tree[-1][-1][0] = 'x = 1'
+			return flatten_tree(tree)
+	else:
+		live = LiveText(tree)
+		block = live.root[-1][-1]
+		def run():
+			block[0] = 'x = 1'
+			return live.update()
+	return run
+
+
+# Getting 100 lines from the middle of a big tree
+
+@benchmark(width=[10, 20], depth=[4], impl=['indented_lines', 'line_index'])
+def middle_slice(width, depth, impl):
+	tree = make_tree(width, depth)
+	middle = text.count_lines(tree) // 2
+	if impl == 'indented_lines':
+		return lambda: indented_lines(tree)[middle:middle+100]
+	else:
+		index = text.LineIndex(tree)
+		return lambda: index.render_slice(middle, middle+100)
+
+
+# The cost of the instrumentation, with no hooks installed and with a `RenderCounters`
+
+@benchmark(width=[10], depth=[1, 3], hooks=['none', 'counters'])
+def instrumented_flatten(width, depth, hooks):
+	from ..instrument import RenderCounters, add_hook, remove_hook
+	tree = make_tree(width, depth)
+	if hooks == 'none':
+		return lambda: flatten_tree(tree)
+	counters = RenderCounters()
+	def run():
+		add_hook(counters)
+		try:
+			return flatten_tree(tree)
+		finally:
+			remove_hook(counters)
+	return run
+
+
+# Embedding a big block of code (e.g. a vendored helper) at some depth:
+# split into lines by hand, or as a `Snippet`
+
+@benchmark(n_lines=[100, 10000], depth=[1, 4], impl=['split', 'snippet'])
+def embedded_block(n_lines, depth, impl):
+	code = '\n'.join('x_{0} = compute({0}, "{1}")'.format(i, 'a' * 40) for i in range(n_lines))
+	def nest(body):
+		for _ in range(depth):
+			body = ['if True:', body]
+		return body
+	if impl == 'split':
+		return lambda: flatten_tree(nest(code.split('\n')))
+	else:
+		return lambda: flatten_tree(nest([text.Snippet(code)]))
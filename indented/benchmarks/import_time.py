@@ -0,0 +1,68 @@
+"""
+Tracks how long `import indented` takes, using `python -X importtime`.
+Every run happens in a fresh interpreter, and the best one is reported.
+It's part of the main benchmark suite, but can also be run on its own:
+
+	python -m indented.benchmarks.import_time [--runs N] [--module indented]
+"""
+
+import argparse
+import subprocess
+import sys
+
+from typing import Dict
+
+from . import benchmark
+
+
+def import_times(module: str = 'indented') -> 'Dict[str, int]':
+	"""
+	Imports `module` in a fresh interpreter and returns the cumulative import time
+	of every module it imported (in microseconds), as reported by `-X importtime`.
+	"""
+	proc = subprocess.run(
+		[sys.executable, '-X', 'importtime', '-c', 'import '+module],
+		stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True,
+	)
+	# Lines look like this:
+	# import time: self [us] | cumulative | imported package
+	# import time:       281 |        281 |   indented.text
+	times = {}
+	for line in proc.stderr.splitlines():
+		if not line.startswith('import time:'):
+			continue
+		(_, cumulative, name) = line[len('import time:'):].split('|')
+		if not cumulative.strip().isdigit():
+			continue # the header
+		times[name.strip()] = int(cumulative)
+	return times
+
+
+def bench_import_time(module: str = 'indented', runs: int = 10) -> 'Dict[str, int]':
+	"Returns the best cumulative import time (in microseconds) of `module` and its submodules over `runs` runs."
+	best = {}
+	for _ in range(runs):
+		for (name, us) in import_times(module).items():
+			if name == module or name.startswith(module+'.'):
+				best[name] = min(us, best.get(name, us))
+	return best
+
+
+@benchmark(timed=False, module=['indented', 'indented.codegen'])
+def import_(module):
+	return {'usec': bench_import_time(module, runs=5)[module]}
+
+
+
+def main(argv=None) -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--runs', type=int, default=10)
+	parser.add_argument('--module', default='indented')
+	args = parser.parse_args(argv)
+
+	for (name, us) in sorted(bench_import_time(args.module, args.runs).items()):
+		print('{name}:\t{us} usec'.format(name=name, us=us))
+
+
+if __name__ == '__main__':
+	main()
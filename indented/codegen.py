@@ -48,11 +48,22 @@ Other helpers:
 	'turtle.move_to(x, y, 0)'
   
 """
-from .text import Tree
+from .text import Tree, flatten_tree, RenderEvent, _render_hooks, _emit_render_event
 
+import ast as _ast
+import hashlib as _hashlib
 import itertools
+import marshal as _marshal
+import os as _os
+import struct as _struct
+import sys as _sys
+import time as _time
+from bisect import bisect_right as _bisect_right
+from collections import OrderedDict as _OrderedDict
 from functools import partial
+from importlib.util import MAGIC_NUMBER as _MAGIC_NUMBER
 from inspect import cleandoc
+from types import CodeType as _CodeType
 
 from typing import (
 	Tuple, Union,
@@ -71,7 +82,20 @@ def params_str(args: Optional[List[str]] = None, kwargs: Union[NoneType,  List[T
 		args = ()
 	
 	kwargs_parts = (arg+'='+val for (arg, val) in kwargs)
-	return '({})'.format(str.join(', ', itertools.chain(args, kwargs_parts)))
+	try:
+		return '({})'.format(str.join(', ', itertools.chain(args, kwargs_parts)))
+	except TypeError:
+		# string-like objects (like `rope.Expr`) in there
+		kwargs_parts = (arg+'='+val for (arg, val) in kwargs)
+		return '({})'.format(str.join(', ', map(str, itertools.chain(args, kwargs_parts))))
+
+def _join(sep: str, strs: 'Iterable[str]') -> str:
+	"`sep.join(strs)`, but also for string-like objects (like `rope.Expr`), which get converted with `str`."
+	strs = strs if type(strs) is list else list(strs)
+	try:
+		return sep.join(strs)
+	except TypeError:
+		return sep.join(map(str, strs))
 
 escape_brackets_for_format = lambda s: s.translate({ord('{'): '{{', ord('}'): '}}'})
 
@@ -117,15 +141,15 @@ def tuple_(exprs: Iterable[str], parens=True) -> str:
 	except StopIteration:
 		return '()'
 	else:
-		rest_with_commas = str.join(', ', exprs)
+		rest_with_commas = _join(', ', exprs)
 		if rest_with_commas:
 			return parens_fmt.format('{}, {}'.format(first, rest_with_commas))
 		else:
 			return parens_fmt.format('{},'.format(first))
 
-dict_ = lambda pairs: '{' + str.join(', ', ('{}: {}'.format(key, val) for (key, val) in pairs) )+ '}'
-list_ = lambda exprs: '[' + str.join(', ', exprs) + ']'
-set_  = lambda exprs: ('{' + str.join(', ', exprs) + '}') if exprs else 'set()'
+dict_ = lambda pairs: '{' + _join(', ', ('{}: {}'.format(key, val) for (key, val) in pairs) )+ '}'
+list_ = lambda exprs: '[' + _join(', ', exprs) + ']'
+set_  = lambda exprs: ('{' + _join(', ', exprs) + '}') if exprs else 'set()'
 
 escaped_literal = lambda x: escape_brackets_for_format(repr(x))
 esc_lit = escaped_literal
@@ -137,7 +161,7 @@ doc = lambda s: cleandoc(s).split('\n')
 
 
 default_if_blank = lambda expr, default: expr if expr else default
-join = lambda *strs, sep='': str.join(sep, strs)
+join = lambda *strs, sep='': _join(sep, strs)
 join_with_op = lambda exprs, op, zero: default_if_blank(str.join(' '+op+' ', ('({})'.format(expr) for expr in exprs)), default=zero)
 
 # TODO: add util to embed double-bracketed format strings like "{{x}}" - `lit` will butcher them
@@ -201,6 +225,253 @@ auto_match = partial(cond, allow_zero_cases=True)
 # auto_match.__name__ = auto_match.__qualname__ = 'auto_match'
 
 
+# Variants of the block helpers for `indented.text.TextBuilder`.
+# They add the head line, and return the builder for use in a `with`:
+#
+#	with if_block(b, 'x > 0'):
+#		b.line('return x')
+
+if_block        = lambda b, test:       b.block(if_(test))
+elif_block      = lambda b, test:       b.block(elif_(test))
+else_block      = lambda b:             b.block(else_())
+for_block       = lambda b, pat, expr:  b.block(for_(pat, expr))
+with_block      = lambda b, expr, pat:  b.block(with_(expr, pat))
+try_block       = lambda b:             b.block(try_())
+except_block    = lambda b:             b.block(except_())
+except_as_block = lambda b, expr, pat:  b.block(except_as_(expr, pat))
+def_block       = lambda b, name, args: b.block(def_(name, args))
+
+
+def cond_into(b: 'TextBuilder', cases_and_bodies: 'List[Tuple[str, Union[Tree, Callable[[], Optional[Tree]]]]]', default: 'Union[NoneType, Tree, Callable[[], Optional[Tree]]]' = None, allow_zero_cases: bool = False) -> None:
+	"""
+	`cond`, but writing into a `TextBuilder` (so there's nothing to splat).
+	A body can also be a function, which gets called inside the block
+	to write into the builder itself (and can return a tree to add).
+
+	>>> from indented.text import TextBuilder
+	>>> b = TextBuilder()
+	>>> with def_block(b, 'sign', ['x']):
+	...     cond_into(b, [when('x > 0', ['return 1']), when('x < 0', lambda: b.line('return -1'))], ['return 0'])
+	>>> print(b.flatten(indent_string='  '))
+	def sign(x):
+	  if x > 0:
+	    return 1
+	  elif x < 0:
+	    return -1
+	  else:
+	    return 0
+	"""
+	assert isinstance(cases_and_bodies, list)
+
+	if cases_and_bodies:
+		head = if_
+		for (test, body) in cases_and_bodies:
+			with b.block(head(test)):
+				_write_body(b, body)
+			head = elif_
+		if default is not None:
+			with b.block(else_()):
+				_write_body(b, default)
+
+	elif allow_zero_cases:
+		if default is not None:
+			_write_body(b, default)
+		else:
+			raise ValueError('cond_into() called without any branches')
+
+	else:
+		raise ValueError('`cond_into()` expects at least 1 if-branch.\n(pass `allow_zero_cases=True` to suppress this error and inline `else_body` instead) ')
+
+def _write_body(b: 'TextBuilder', body: 'Union[Tree, Callable[[], Optional[Tree]]]') -> None:
+	if type(body) is not list and callable(body):
+		body = body()
+	if body is not None:
+		b.text.extend_tree(body, b.indent_level)
+
+
+
+SWITCH_STRATEGIES = ('auto', 'linear', 'binary', 'hybrid', 'table')
+
+def switch(var: str, cases: 'Union[Dict[Any, Tree], List[Tuple[Any, Tree]]]', default: 'Optional[Tree]' = None, strategy: str = 'auto', exhaustive: bool = False, linear_cutoff: int = 3, typed_keys: bool = False) -> Tree:
+	"""
+	Generates code that runs the body matching the value of `var`.
+	`cases` maps keys (python values, which get `lit`ed) to bodies.
+	Like `cond`, it returns a Tree meant to be splatted into a block.
+
+	`strategy` picks the shape of the generated code:
+	- 'linear': an if-elif chain, like `cond`
+	- 'binary': a balanced binary search on the (sorted) keys,
+	            so only ~log2(n) comparisons are needed
+	- 'hybrid': a binary search that switches to a linear chain
+	            once there's at most `linear_cutoff` keys left
+	- 'table':  a lookup in a tuple (for int keys) or a dict (for other keys).
+	            Only possible if every body is a `return` of a literal value,
+	            like `['return "foo"']`.
+	            (a dict display gets rebuilt on every call, so for non-int keys it's rarely a win)
+	- 'auto':   picks one of the above based on the number and density of the keys
+
+	Only 'linear' compares with `==`, so only it works for any value of `var`.
+	The others assume that `var` has the same type as the keys: 'binary' and 'hybrid'
+	compare with `<` (so `'a' < 1` raises), and a tuple table indexes with `var`
+	(so `3.0` isn't found, even though `3.0 == 3`; for non-exhaustive tables, values that aren't
+	exactly `int`s get the default). That's why 'auto' only picks them if `typed_keys` is true
+	(you promise that `var` is always of the keys' type) or `exhaustive` is.
+
+	If `exhaustive` is true, `var` is assumed to always be one of the keys,
+	which allows skipping some checks. Otherwise, `default` runs if no key matches.
+
+	>>> from indented.text import indented_lines
+	>>> for line in indented_lines(['def f(x):', switch('x', {0: ['return a()'], 1: ['return b()'], 2: ['return c()']}, strategy='binary', exhaustive=True)], indent_string='    '):
+	...     print(line)
+	def f(x):
+	    if x < 1:
+	        return a()
+	    else:
+	        if x < 2:
+	            return b()
+	        else:
+	            return c()
+
+	>>> switch('x', {1: ['return "foo"'], 3: ['return "bar"']}, default=['return None'], strategy='table')
+	['if type(x) is int and 1 <= x <= 3:', ['return ("foo", None, "bar")[x - 1]'], 'return None']
+
+	Without `typed_keys`, 'auto' stays with `==`, so any value works:
+
+	>>> cases = {i: ['return {}'.format(i * 10)] for i in range(8)}
+	>>> f = eval_def(flatten_tree([def_('f', ['x']), switch('x', cases, default=['return -1'])]))
+	>>> f(3), f(3.0), f('a')
+	(30, 30, -1)
+	>>> f = eval_def(flatten_tree([def_('f', ['x']), switch('x', cases, default=['return -1'], typed_keys=True)]))
+	>>> f(3), f(3.0), f('a')
+	(30, -1, -1)
+	"""
+	if strategy not in SWITCH_STRATEGIES:
+		raise ValueError('Unknown switch strategy {!r}, expected one of {!r}'.format(strategy, SWITCH_STRATEGIES))
+	cases = list(cases.items()) if isinstance(cases, dict) else list(cases)
+	if not cases:
+		raise ValueError('`switch()` expects at least 1 case')
+
+	keys = [key for (key, _) in cases]
+	int_keys = all(type(key) is int for key in keys)
+	orderable_keys = int_keys or all(type(key) is str for key in keys)
+
+	if strategy == 'auto':
+		if len(cases) <= SWITCH_LINEAR_MAX_CASES or not (typed_keys or exhaustive):
+			strategy = 'linear'
+		elif int_keys and _switch_density(keys) >= SWITCH_TABLE_MIN_DENSITY and _switch_table_values(cases, default, exhaustive, int_keys) is not None:
+			strategy = 'table'
+		elif orderable_keys:
+			strategy = 'hybrid'
+		else:
+			strategy = 'linear'
+
+	if strategy == 'linear':
+		return _switch_linear(var, cases, default, exhaustive)
+	elif strategy == 'binary':
+		return _switch_binsearch(var, sorted(cases, key=lambda case: case[0]), default, exhaustive, linear_cutoff=1)
+	elif strategy == 'hybrid':
+		return _switch_binsearch(var, sorted(cases, key=lambda case: case[0]), default, exhaustive, linear_cutoff=linear_cutoff)
+	else: # strategy == 'table'
+		return _switch_table(var, cases, default, exhaustive, int_keys)
+
+# Rough thresholds, measured on CPython 3.11
+SWITCH_LINEAR_MAX_CASES  = 4
+SWITCH_TABLE_MIN_DENSITY = 0.5
+
+_switch_density = lambda keys: len(keys) / (max(keys) - min(keys) + 1)
+_switch_test    = lambda var, key: var+' == '+lit(key)
+
+
+def _switch_linear(var: str, cases: 'List[Tuple[Any, Tree]]', default: 'Optional[Tree]', exhaustive: bool) -> Tree:
+	if exhaustive:
+		# the last case is the only remaining possibility, so it doesn't need a test
+		*cases, (_, default) = cases
+	return auto_match([when(_switch_test(var, key), body) for (key, body) in cases], default)
+
+
+def _switch_binsearch(var: str, sorted_cases: 'List[Tuple[Any, Tree]]', default: 'Optional[Tree]', exhaustive: bool, linear_cutoff: int) -> Tree:
+	# (keys are unique, so there's no risk of getting stuck on a range)
+	if len(sorted_cases) <= linear_cutoff:
+		return _switch_linear(var, sorted_cases, default, exhaustive)
+	mid = len(sorted_cases) // 2
+	(mid_key, _) = sorted_cases[mid]
+	return [
+		if_(var+' < '+lit(mid_key)),
+			_switch_binsearch(var, sorted_cases[:mid], default, exhaustive, linear_cutoff),
+		else_(),
+			_switch_binsearch(var, sorted_cases[mid:], default, exhaustive, linear_cutoff),
+	]
+
+
+def _switch_table(var: str, cases: 'List[Tuple[Any, Tree]]', default: 'Optional[Tree]', exhaustive: bool, int_keys: bool) -> Tree:
+	values = _switch_table_values(cases, default, exhaustive, int_keys)
+	if values is None:
+		raise ValueError("`switch(..., strategy='table')` needs every body to be a `return` of a literal value{}".format(
+			'' if exhaustive else ', including the default, unless `exhaustive=True`'
+		))
+	(exprs_by_key, default_expr) = values
+
+	if int_keys:
+		(low, high) = (min(exprs_by_key), max(exprs_by_key))
+		table = tuple_([exprs_by_key.get(key, default_expr) for key in range(low, high+1)])
+		lookup = 'return '+item(table, var if low == 0 else '{} - {}'.format(var, low))
+		if exhaustive:
+			return [lookup]
+		else:
+			# (the type check keeps out floats and anything else that can't index a tuple)
+			return [if_('type({var}) is int and {} <= {var} <= {}'.format(low, high, var=var)), [lookup], *(default or [])]
+	else:
+		table = dict_((lit(key), expr) for (key, expr) in exprs_by_key.items())
+		if exhaustive:
+			return ['return '+item(table, var)]
+		else:
+			return ['return '+method(table, 'get', [var, default_expr])]
+
+
+def _switch_table_values(cases, default, exhaustive: bool, int_keys: bool) -> 'Optional[Tuple[Dict[Any, str], str]]':
+	"""
+	Returns the returned expressions for each key and for the default (if all of them are literals),
+	or None if the cases can't be turned into a table.
+	"""
+	exprs_by_key = {}
+	for (key, body) in cases:
+		expr = _returned_literal(body)
+		if expr is None:
+			return None
+		exprs_by_key[key] = expr
+
+	if default is not None:
+		default_expr = _returned_literal(default)
+		if default_expr is None:
+			return None
+	elif exhaustive:
+		default_expr = 'None' # only used to fill the gaps in a tuple table, which are never looked up
+	else:
+		# Without a default, a non-matching value should just fall through,
+		# and a table lookup can't express that.
+		if not int_keys or len(exprs_by_key) != max(exprs_by_key) - min(exprs_by_key) + 1:
+			return None
+		default_expr = 'None'
+	return (exprs_by_key, default_expr)
+
+
+def _returned_literal(body: Tree) -> 'Optional[str]':
+	"If `body` is `['return <some literal>']`, returns the literal's source."
+	if len(body) != 1 or type(body[0]) is not str:
+		return None
+	line = body[0].strip()
+	if line == 'return':
+		return 'None'
+	if not line.startswith('return '):
+		return None
+	expr = line[len('return '):].strip()
+	try:
+		_ast.literal_eval(expr)
+	except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+		return None
+	return expr
+
+
 
 #############
 # Utilities #
@@ -208,17 +479,421 @@ auto_match = partial(cond, allow_zero_cases=True)
 
 
 
-def eval_def(src: str) -> 'Fun[..., Any]':
-	""" `exec` a function definition and return the function. """  
+class CodeCache:
+	"""
+	A cache of compiled code objects, keyed by a hash of the source and the compile flags.
+	Used by `eval_def` to avoid recompiling identical generated functions.
+
+	Keeps up to `maxsize` code objects in memory, evicting the least recently used ones.
+	If `cache_dir` is given, code objects are also `marshal`ed to files in that directory,
+	so they can be reused by other processes. Like in `__pycache__`, the files
+	are tagged with the interpreter's magic number, and ignored (and overwritten)
+	when it doesn't match.
+
+	>>> cache = CodeCache()
+	>>> code = cache.compile('x = 1')
+	>>> cache.compile('x = 1') is code
+	True
+	>>> (cache.hits, cache.misses)
+	(1, 1)
+	"""
+	__slots__ = ('maxsize', 'cache_dir', 'hits', 'disk_hits', 'misses', 'time_saved', '_entries')
+
+	def __init__(self, maxsize: int = 1024, cache_dir: 'Optional[str]' = None):
+		self.maxsize = maxsize
+		self.cache_dir = cache_dir
+		self.hits = self.disk_hits = self.misses = 0
+		self.time_saved = 0.0 # seconds, estimated from how long the cached code took to compile
+		self._entries = _OrderedDict() # key -> (code, compile_seconds)
+
+
+	def compile(self, src: str, filename: str = '<string>', mode: str = 'exec', flags: int = 0) -> _CodeType:
+		key = self._key(src, filename, mode, flags)
+
+		entry = self._entries.get(key)
+		if entry is not None:
+			self._entries.move_to_end(key)
+			self.hits += 1
+			(code, compile_seconds) = entry
+			self.time_saved += compile_seconds
+			return code
+
+		entry = self._load(key)
+		if entry is not None:
+			self.disk_hits += 1
+		else:
+			self.misses += 1
+			start = _time.perf_counter()
+			code = compile(src, filename, mode, flags, dont_inherit=True)
+			entry = (code, _time.perf_counter() - start)
+			self._dump(key, entry)
+
+		self._entries[key] = entry
+		if len(self._entries) > self.maxsize:
+			self._entries.popitem(last=False)
+		return entry[0]
+
+
+	@staticmethod
+	def _key(src: str, filename: str, mode: str, flags: int) -> str:
+		h = _hashlib.blake2b(digest_size=20)
+		# `compile` uses the interpreter's optimization level (`-O`), so it's part of the key -
+		# otherwise a normal process could load code compiled without asserts from the disk cache
+		h.update('{}\0{}\0{}\0{}\0'.format(filename, mode, flags, _sys.flags.optimize).encode('utf-8'))
+		h.update(src.encode('utf-8', 'surrogatepass'))
+		return h.hexdigest()
+
+	def _path(self, key: str) -> 'Optional[str]':
+		if self.cache_dir is None or _sys.implementation.cache_tag is None:
+			return None
+		return _os.path.join(self.cache_dir, '{}.{}.bin'.format(key, _sys.implementation.cache_tag))
+
+	# File layout: MAGIC_NUMBER, compile time in seconds (a double), marshalled code object
+
+	_header = _struct.Struct('<d')
+
+	def _load(self, key: str) -> 'Optional[Tuple[_CodeType, float]]':
+		path = self._path(key)
+		if path is None:
+			return None
+		start = _time.perf_counter()
+		try:
+			with open(path, 'rb') as f:
+				data = f.read()
+		except OSError:
+			return None
+		magic_end = len(_MAGIC_NUMBER)
+		header_end = magic_end + self._header.size
+		if data[:magic_end] != _MAGIC_NUMBER or len(data) < header_end:
+			return None
+		(compile_seconds,) = self._header.unpack(data[magic_end:header_end])
+		try:
+			code = _marshal.loads(data[header_end:])
+		except (EOFError, ValueError, TypeError):
+			return None
+		self.time_saved += max(0.0, compile_seconds - (_time.perf_counter() - start))
+		return (code, compile_seconds)
+
+	def _dump(self, key: str, entry: 'Tuple[_CodeType, float]') -> None:
+		path = self._path(key)
+		if path is None:
+			return
+		(code, compile_seconds) = entry
+		data = _MAGIC_NUMBER + self._header.pack(compile_seconds) + _marshal.dumps(code)
+		temp_path = '{}.{}.tmp'.format(path, _os.getpid())
+		try:
+			_os.makedirs(self.cache_dir, exist_ok=True)
+			with open(temp_path, 'wb') as f:
+				f.write(data)
+			_os.replace(temp_path, path) # atomic, so other processes never see a partial file
+		except OSError:
+			# the disk cache is best-effort
+			try: _os.unlink(temp_path)
+			except OSError: pass
+
+
+	def stats(self) -> 'Dict[str, Union[int, float]]':
+		lookups = self.hits + self.disk_hits + self.misses
+		return dict(
+			hits=self.hits, disk_hits=self.disk_hits, misses=self.misses,
+			hit_rate=(self.hits + self.disk_hits) / lookups if lookups else 0.0,
+			time_saved=self.time_saved,
+			size=len(self._entries),
+		)
+
+	def clear(self) -> None:
+		"Empties the in-memory cache. Files in `cache_dir` are left alone."
+		self._entries.clear()
+
+	def __repr__(self) -> str:
+		return '{}(maxsize={!r}, cache_dir={!r}) <{}>'.format(type(self).__qualname__, self.maxsize, self.cache_dir, self.stats())
+
+
+# The cache used by `eval_def` by default.
+code_cache = CodeCache()
+
+
+
+class ConstPool:
+	"""
+	Passes values to generated code by reference, instead of splicing their `repr` into the source.
+	Big values (like lookup tables) make huge sources, which `eval_def` then has to tokenize,
+	parse and constant-fold, and some values don't have a `repr` that can be `eval`ed at all.
+	`pool.lit(value)` inlines small literal values like `lit` does, and binds everything else
+	to a generated name in `pool.namespace` - pass that to `eval_def` as the `namespace`.
+
+	>>> pool = ConstPool()
+	>>> squares = {i: i*i for i in range(1000)}
+	>>> pool.lit(3), pool.lit('abc'), pool.lit(squares), pool.lit(float('nan')), pool.lit(squares)
+	('3', "'abc'", '_const_0', '_const_1', '_const_0')
+	>>> f = eval_def(flatten_tree([def_('square', ['x']), ['return ' + item(pool.lit(squares), 'x')]]), namespace=pool.namespace)
+	>>> f(12)
+	144
+
+	`ref` always passes by reference (say, for a mutable value the generated code should share).
+	Each object gets one name, however many times it's used.
+	"""
+	__slots__ = ('namespace', 'max_inline_size', 'prefix', '_names')
+
+	def __init__(self, max_inline_size: int = 256, prefix: str = '_const_'):
+		self.namespace = {} # type: Dict[str, Any]
+		self.max_inline_size = max_inline_size # in characters of `repr`
+		self.prefix = prefix
+		self._names = {} # type: Dict[int, str] # id(value) -> name (the values are kept alive by `namespace`, so the ids stay valid)
+
+	def lit(self, value: 'Any') -> str:
+		"`repr(value)` if it's small and can be `eval`ed back, a reference to `value` otherwise."
+		if _literal_repr_size(value, self.max_inline_size) is not None:
+			return repr(value)
+		return self.ref(value)
+
+	def ref(self, value: 'Any') -> str:
+		"The name bound to `value` in `namespace`."
+		name = self._names.get(id(value))
+		if name is None:
+			name = self._names[id(value)] = self.prefix + str(len(self._names))
+			self.namespace[name] = value
+		return name
+
+	def __len__(self) -> int:
+		return len(self._names)
+
+	def __repr__(self) -> str:
+		return '{}(max_inline_size={!r}) <{} values>'.format(type(self).__qualname__, self.max_inline_size, len(self))
+
+
+def _literal_repr_size(value: 'Any', limit: int) -> 'Optional[int]':
+	"""
+	Returns (roughly) the length of `repr(value)`, or None if it's longer than `limit`,
+	or if `eval(repr(value))` wouldn't give back an equal value.
+	Gives up as soon as it's over the limit, so it doesn't have to walk (or `repr`) big values.
+	"""
+	t = type(value)
+	if t is str or t is bytes:
+		if len(value) > limit:
+			return None
+		size = len(repr(value))
+	elif t is int or t is bool or value is None:
+		size = len(repr(value))
+	elif t is float or t is complex:
+		if not (value == value and abs(value) != float('inf')): # nan/inf don't have a literal
+			return None
+		size = len(repr(value))
+	elif t is tuple or t is list or t is set or t is frozenset:
+		if len(value) > limit:
+			return None
+		size = 12 # the brackets (and `frozenset(...)`)
+		for x in value:
+			x_size = _literal_repr_size(x, limit - size)
+			if x_size is None:
+				return None
+			size += x_size + 2
+	elif t is dict:
+		if len(value) > limit:
+			return None
+		size = 2
+		for (k, v) in value.items():
+			k_size = _literal_repr_size(k, limit - size)
+			v_size = _literal_repr_size(v, limit - size) if k_size is not None else None
+			if v_size is None:
+				return None
+			size += k_size + v_size + 4
+	else:
+		return None
+	return size if size <= limit else None
+
+
+
+def eval_def(src: str, cache: 'Optional[CodeCache]' = code_cache, namespace: 'Optional[Dict[str, Any]]' = None) -> 'Fun[..., Any]':
+	"""
+	`exec` a function definition and return the function.
+	The compiled code is looked up in / stored in `cache` (pass `None` to always compile).
+	`namespace` becomes the function's globals (like a `ConstPool`'s `namespace`).
+	"""  
+	start = _time.perf_counter() if _render_hooks else None
+	code = cache.compile(src) if cache is not None else compile(src, '<string>', 'exec', dont_inherit=True)
 	temp_local_namespace  = {}
-	exec(src, {}, temp_local_namespace)
+	exec(code, namespace if namespace is not None else {}, temp_local_namespace)
 	assert len(temp_local_namespace) == 1, "The source:\n\n{src}\n\ndefined more than one function. locals:\n {locals}".format(src=src, locals=temp_local_namespace)
 	func = next(iter(temp_local_namespace.values()))
 	assert func not in globals().values(), "Function leaked into globals"
+	if start is not None:
+		_emit_render_event(RenderEvent('eval_def', _time.perf_counter() - start, src.count('\n') + 1, len(src)))
 	return func
 
 
 
+class EvalDefsError(Exception):
+	"""
+	Raised by `eval_defs` when one of the sources fails to compile or run,
+	or doesn't define exactly one new function.
+	`index` and `source` tell you which one it was.
+	"""
+	def __init__(self, message: str, index: int, source: str):
+		super().__init__('source #{}: {}\n\n{}'.format(index, message, source))
+		self.index  = index
+		self.source = source
+
+
+def eval_defs(trees_or_sources: 'Iterable[Union[str, Tree]]', cache: 'Optional[CodeCache]' = code_cache, workers: 'Optional[int]' = None, namespace: 'Optional[Dict[str, Any]]' = None) -> 'Dict[str, Fun[..., Any]]':
+	"""
+	Like `eval_def`, but for many function definitions at once.
+	Sources (or trees, which get flattened first) are compiled together as one module,
+	instead of paying for a separate `compile`+`exec` per function.
+	Returns a dict mapping the function names to the functions.
+	Every source must define exactly one function, and the names must be unique.
+	`namespace` becomes the functions' globals, like in `eval_def`.
+	If something goes wrong, an `EvalDefsError` says which source caused it.
+
+	If `workers` is given, the sources are split into that many batches which get
+	compiled in a `ProcessPoolExecutor` (and sent back as `marshal`ed code objects).
+	That's only worth it for very large batches.
+
+	>>> fns = eval_defs(['def foo(x):\\n\\treturn x+1', [def_('bar', []), ['return 2']]])
+	>>> sorted(fns), fns['foo'](fns['bar']())
+	(['bar', 'foo'], 3)
+
+	Decorators are fine, even ones that don't return a function:
+
+	>>> import functools
+	>>> fns = eval_defs(['@functools.lru_cache\\ndef baz(x):\\n\\treturn [x]'], namespace={'functools': functools})
+	>>> fns['baz'](1) is fns['baz'](1)
+	True
+
+	>>> eval_defs(['def foo(): pass', 'def bar(:'])
+	Traceback (most recent call last):
+	  ...
+	indented.codegen.EvalDefsError: source #1: invalid syntax
+	<BLANKLINE>
+	def bar(:
+	"""
+	sources = [
+		src if isinstance(src, str) else flatten_tree(src)
+		for src in trees_or_sources
+	]
+	if not sources:
+		return {}
+
+	if workers is None:
+		batches = [(0, sources)]
+	else:
+		batch_size = -(-len(sources) // workers) # ceil
+		batches = [(start, sources[start:start+batch_size]) for start in range(0, len(sources), batch_size)]
+
+	joined = [_join_sources(batch) for (_, batch) in batches]
+
+	if workers is None or len(batches) == 1:
+		compile_batch = (lambda src: cache.compile(src, _EVAL_DEFS_FILENAME)) if cache is not None else _compile_defs
+		codes = (_compile_batch_attributed(compile_batch, src, first_index, sources, line_starts) for ((first_index, _), (src, line_starts)) in zip(batches, joined))
+	else:
+		from concurrent.futures import ProcessPoolExecutor
+		cache_dir = cache.cache_dir if cache is not None else None
+		with ProcessPoolExecutor(max_workers=workers) as pool:
+			futures = [pool.submit(_compile_defs_marshalled, src, cache_dir) for (src, _) in joined]
+			codes = [
+				_compile_batch_attributed(lambda _: _marshal.loads(future.result()), src, first_index, sources, line_starts)
+				for (future, (first_index, _), (src, line_starts)) in zip(futures, batches, joined)
+			]
+
+	functions = {}
+	for (code, (first_index, batch), (src, line_starts)) in zip(codes, batches, joined):
+		batch_namespace = {}
+		try:
+			exec(code, namespace if namespace is not None else {}, batch_namespace)
+		except Exception as e:
+			lineno = _traceback_lineno(e.__traceback__, code)
+			index = first_index + _source_index(line_starts, lineno) if lineno is not None else first_index
+			raise EvalDefsError('{}: {}'.format(type(e).__qualname__, e), index, sources[index]) from e
+
+		defined_by = _defined_by_code(batch_namespace, code, line_starts, len(batch))
+		if defined_by is None or any(len(names) != 1 for names in defined_by):
+			# Something's off (or there are decorators in the way) - find out which source is to blame the slow way
+			defined_by = _defined_by_ast(src, line_starts, len(batch))
+			defined = {name for names in defined_by for name in names}
+			for name in batch_namespace:
+				if name not in defined:
+					index = first_index + _source_index(line_starts, _first_non_def_lineno(src))
+					raise EvalDefsError('defined {!r}, which is not a function'.format(name), index, sources[index])
+		for (i, names) in enumerate(defined_by):
+			if len(names) != 1:
+				index = first_index + i
+				raise EvalDefsError('expected a definition of exactly one function, got {!r}'.format(names), index, sources[index])
+			if names[0] in functions:
+				index = first_index + i
+				raise EvalDefsError('{!r} is already defined by an earlier source'.format(names[0]), index, sources[index])
+			functions[names[0]] = batch_namespace[names[0]]
+
+	return functions
+
+
+_EVAL_DEFS_FILENAME = '<eval_defs>'
+
+_compile_defs = lambda src: compile(src, _EVAL_DEFS_FILENAME, 'exec', dont_inherit=True)
+
+def _compile_defs_marshalled(src: str, cache_dir: 'Optional[str]') -> bytes:
+	# runs in a worker process
+	code = CodeCache(cache_dir=cache_dir).compile(src, _EVAL_DEFS_FILENAME) if cache_dir is not None else _compile_defs(src)
+	return _marshal.dumps(code)
+
+
+def _join_sources(sources: 'List[str]') -> 'Tuple[str, List[int]]':
+	"Returns the joined source and the line numbers each of the sources starts at."
+	line_starts = []
+	lineno = 1
+	for src in sources:
+		line_starts.append(lineno)
+		lineno += src.count('\n') + 1
+	return (str.join('\n', sources), line_starts)
+
+_source_index = lambda line_starts, lineno: max(_bisect_right(line_starts, lineno) - 1, 0)
+
+def _compile_batch_attributed(compile_batch, src: str, first_index: int, sources: 'List[str]', line_starts: 'List[int]') -> _CodeType:
+	try:
+		return compile_batch(src)
+	except SyntaxError as e:
+		index = first_index + _source_index(line_starts, e.lineno or 1)
+		raise EvalDefsError(e.msg, index, sources[index]) from e
+
+def _defined_by_code(batch_namespace: 'Dict[str, Any]', code: _CodeType, line_starts: 'List[int]', n_sources: int) -> 'Optional[List[List[str]]]':
+	"""
+	The names defined by each source, going by where the functions' code starts.
+	The fast way, which only works if all of them are plain (undecorated, or decorated and returned as-is) functions -
+	otherwise returns None, and the source has to be parsed (see `_defined_by_ast`).
+	"""
+	defined_by = [[] for _ in range(n_sources)]
+	for (name, value) in batch_namespace.items():
+		func_code = getattr(value, '__code__', None)
+		if type(func_code) is not _CodeType or func_code.co_filename != code.co_filename or func_code.co_name != name:
+			return None
+		defined_by[_source_index(line_starts, func_code.co_firstlineno)].append(name)
+	return defined_by
+
+_DEF_TYPES = (_ast.FunctionDef, _ast.AsyncFunctionDef)
+
+def _defined_by_ast(src: str, line_starts: 'List[int]', n_sources: int) -> 'List[List[str]]':
+	"The names of the top-level functions defined by each source."
+	defined_by = [[] for _ in range(n_sources)]
+	for stmt in _ast.parse(src).body:
+		if isinstance(stmt, _DEF_TYPES):
+			defined_by[_source_index(line_starts, stmt.lineno)].append(stmt.name)
+	return defined_by
+
+def _first_non_def_lineno(src: str) -> int:
+	for stmt in _ast.parse(src).body:
+		if not isinstance(stmt, _DEF_TYPES):
+			return stmt.lineno
+	return 1
+
+def _traceback_lineno(tb, code: _CodeType) -> 'Optional[int]':
+	lineno = None
+	while tb is not None:
+		if tb.tb_frame.f_code.co_filename == code.co_filename:
+			lineno = tb.tb_lineno # keep the innermost one, it's the closest to the error
+		tb = tb.tb_next
+	return lineno
+
+
+
 
 
 # Change the names of lambdas from '<lambda>' to however
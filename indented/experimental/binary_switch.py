@@ -28,6 +28,9 @@ something like this:
 
 which is nice, because we only have to do ~log2(n) comparisons.
 That being said, this usecase might be too specific to be useful to others. 
+
+(See `indented.codegen.switch` for the supported version,
+ which also handles sparse and non-integer keys and lookup tables)
 """
 
 from ..text import flatten_tree
@@ -94,23 +97,28 @@ mk_def_get_variant = lambda n, switch: [
     ]
 ]
 
-get_variants = get_variant_binsearch, get_variant_linear = [
-    eval_tree(mk_def_get_variant(n, switch), verbose=True, dis=True)
-    for switch in (switch_binsearch, switch_linear)
-]
-
+def make_get_variants(verbose=False, dis=False):
+    """ Returns `(get_variant_binsearch, get_variant_linear, get_variant_index)` """
+    get_variant_binsearch, get_variant_linear = [
+        eval_tree(mk_def_get_variant(n, switch), verbose=verbose, dis=dis)
+        for switch in (switch_binsearch, switch_linear)
+    ]
 
-print(dis.findlabels(get_variant_linear.__code__.co_code))
-print()
+    get_variant_index = eval_tree([
+        'def get_variant_index(_variant_id):', [
+            'return '+tuple_(map(lit, variants))+'[_variant_id]'
+        ]
+    ], verbose=verbose, dis=dis)
 
-get_variant_index = eval_tree([
-    'def get_variant_index(_variant_id):', [
-        'return '+tuple_(map(lit, variants))+'[_variant_id]'
-    ]
-], verbose=True, dis=True)
+    return get_variant_binsearch, get_variant_linear, get_variant_index
 
 
 if __name__ == '__main__':
+    get_variant_binsearch, get_variant_linear, get_variant_index = make_get_variants(verbose=True, dis=True)
+
+    print(dis.findlabels(get_variant_linear.__code__.co_code))
+    print()
+
     import timeit
     setup_linear = "from __main__ import get_variant_linear    as get_variant"
     setup_binary = "from __main__ import get_variant_binsearch as get_variant"
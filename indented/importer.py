@@ -0,0 +1,202 @@
+"""
+An import hook for generated modules, with an on-disk cache of their code.
+
+Generating a module at startup means building a tree, rendering it and compiling the result -
+in every process, every time. A `GeneratedModuleFinder` makes the generated module importable
+under a name, and keeps the rendered source and the compiled code in `cache_dir`.
+Each module is registered with a `key`, something cheap to compute that changes whenever
+the generated code would (e.g. a version string, or a hash of the inputs).
+While the key stays the same, importing the module just loads the cached code -
+the generator doesn't even get called.
+
+>>> import tempfile
+>>> temp_dir = tempfile.TemporaryDirectory()
+>>> cache_dir = temp_dir.name
+>>> calls = []
+>>> def generate():
+...     calls.append(1)
+...     return ['def double(x):', ['return x * 2']]
+>>> finder = GeneratedModuleFinder(cache_dir)
+>>> finder.register('_indented_example', generate, key='v1')
+>>> with finder.installed():
+...     import _indented_example
+>>> _indented_example.double(21), len(calls)
+(42, 1)
+>>> _indented_example.__file__ == finder.source_path('_indented_example')
+True
+
+Another process (here: another finder, after the module is forgotten) gets it from the cache:
+
+>>> import sys; del sys.modules['_indented_example']
+>>> finder = GeneratedModuleFinder(cache_dir)
+>>> finder.register('_indented_example', generate, key='v1')
+>>> with finder.installed():
+...     import _indented_example
+>>> _indented_example.double(21), len(calls), finder.stats()
+(42, 1, {'hits': 1, 'misses': 0})
+>>> del sys.modules['_indented_example']
+>>> temp_dir.cleanup()
+
+The source is written next to the cached code, so tracebacks and `inspect` can show the generated lines.
+The files are replaced atomically, so processes sharing a `cache_dir` never see a partial file.
+Parent packages of a registered module have to be importable as usual.
+"""
+
+import hashlib
+import marshal
+import os
+import sys
+from contextlib import contextmanager
+from importlib.abc import InspectLoader, MetaPathFinder
+from importlib.util import MAGIC_NUMBER, spec_from_file_location
+from types import CodeType, ModuleType
+
+from .text import Tree, flatten_tree, _temp_path_for
+
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, Union
+
+
+ModuleGenerator = 'Callable[[], Union[str, Tree]]'
+
+
+class GeneratedModuleFinder(MetaPathFinder, InspectLoader):
+	"""
+	A `sys.meta_path` finder (and loader) for modules made by generator functions.
+	A generator takes no arguments and returns the module's code, as a tree or a string.
+	Register the modules, then `install()` the finder (or use `with finder.installed(): ...`).
+	"""
+
+	def __init__(self, cache_dir: str):
+		self.cache_dir = cache_dir
+		self.hits = self.misses = 0
+		self._modules = {} # type: Dict[str, Tuple[ModuleGenerator, Any]] # fullname -> (generate, key)
+
+
+	def register(self, fullname: str, generate: ModuleGenerator, key: Any) -> None:
+		"""
+		Makes `generate()` importable as `fullname`. `key` can be anything with a stable `repr`,
+		and should change whenever the generated code would.
+		"""
+		self._modules[fullname] = (generate, key)
+
+	def module(self, fullname: str, key: Any) -> 'Callable[[ModuleGenerator], ModuleGenerator]':
+		"`register` as a decorator."
+		def decorator(generate: ModuleGenerator) -> ModuleGenerator:
+			self.register(fullname, generate, key)
+			return generate
+		return decorator
+
+
+	def install(self) -> None:
+		"Adds the finder to the front of `sys.meta_path`."
+		if self not in sys.meta_path:
+			sys.meta_path.insert(0, self)
+
+	def uninstall(self) -> None:
+		if self in sys.meta_path:
+			sys.meta_path.remove(self)
+
+	@contextmanager
+	def installed(self) -> 'Iterator[GeneratedModuleFinder]':
+		self.install()
+		try:
+			yield self
+		finally:
+			self.uninstall()
+
+
+	def source_path(self, fullname: str) -> str:
+		return os.path.join(self.cache_dir, fullname + '.py')
+
+	def cache_path(self, fullname: str) -> str:
+		# Tagged like in `__pycache__`, so processes with different `-O` levels don't share compiled code
+		opt = '.opt-{}'.format(sys.flags.optimize) if sys.flags.optimize else ''
+		return os.path.join(self.cache_dir, '{}.{}{}.pyc'.format(fullname, sys.implementation.cache_tag or 'nocache', opt))
+
+
+	# Finder
+
+	def find_spec(self, fullname: str, path=None, target: 'Optional[ModuleType]' = None):
+		if fullname not in self._modules:
+			return None
+		spec = spec_from_file_location(fullname, self.source_path(fullname), loader=self)
+		spec.cached = self.cache_path(fullname)
+		return spec
+
+
+	# Loader
+
+	def exec_module(self, module: ModuleType) -> None:
+		exec(self.get_code(module.__spec__.name), module.__dict__)
+
+	def get_code(self, fullname: str) -> CodeType:
+		(generate, key) = self._modules[fullname]
+		header = MAGIC_NUMBER + _key_digest(fullname, key)
+		cache_path = self.cache_path(fullname)
+
+		code = _load_code(cache_path, header)
+		if code is not None:
+			self.hits += 1
+			return code
+
+		self.misses += 1
+		src = generate()
+		if not isinstance(src, str):
+			src = flatten_tree(src)
+		source_path = self.source_path(fullname)
+		code = compile(src, source_path, 'exec', dont_inherit=True)
+		# The source goes first, so the cached code never refers to a file that isn't there yet
+		_write_atomic(source_path, src.encode('utf-8'))
+		_write_atomic(cache_path, header + marshal.dumps(code))
+		return code
+
+	def get_source(self, fullname: str) -> 'Optional[str]':
+		if fullname not in self._modules:
+			raise ImportError('{!r} is not a registered module'.format(fullname), name=fullname)
+		try:
+			with open(self.source_path(fullname), encoding='utf-8') as f:
+				return f.read()
+		except OSError:
+			return None
+
+	def is_package(self, fullname: str) -> bool:
+		return False
+
+
+	def stats(self) -> 'Dict[str, int]':
+		return {'hits': self.hits, 'misses': self.misses}
+
+	def __repr__(self) -> str:
+		return '{}({!r})'.format(type(self).__qualname__, self.cache_dir)
+
+
+
+# File layout: MAGIC_NUMBER, digest of the module name, key and optimization level, marshalled code object
+
+def _key_digest(fullname: str, key: Any) -> bytes:
+	return hashlib.blake2b('{}\0{!r}\0{}'.format(fullname, key, sys.flags.optimize).encode('utf-8'), digest_size=20).digest()
+
+def _load_code(path: str, header: bytes) -> 'Optional[CodeType]':
+	try:
+		with open(path, 'rb') as f:
+			data = f.read()
+	except OSError:
+		return None
+	if not data.startswith(header):
+		return None # stale, or from another Python version
+	try:
+		return marshal.loads(memoryview(data)[len(header):])
+	except (EOFError, ValueError, TypeError):
+		return None # corrupted
+
+def _write_atomic(path: str, data: bytes) -> None:
+	temp_path = _temp_path_for(path)
+	try:
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(temp_path, 'wb') as f:
+			f.write(data)
+		os.replace(temp_path, path) # atomic, so other processes never see a partial file
+	except OSError:
+		# the cache is best-effort - the module still gets imported
+		try: os.unlink(temp_path)
+		except OSError: pass
@@ -0,0 +1,220 @@
+"""
+Incremental re-rendering of texts that change a little at a time.
+
+`LiveText` wraps a text in the nested-list format (see `indented.text`) into a tree of mutable
+`LiveBlock`s, which remember how many lines they rendered to, and where.
+Changing a block marks it (and its ancestors) as needing an update, and `LiveText.update()`
+re-renders only the changed blocks, splicing the new lines into the previously rendered ones.
+Clean blocks inside a changed block are copied over instead of being rendered again.
+So the cost of an update depends on the size of the change, not the size of the whole text.
+
+>>> text = LiveText([
+...     'def f(x):', [
+...         'if x:', [
+...             'return 1',
+...         ],
+...         'return 0',
+...     ],
+... ], indent_string='  ')
+>>> text.lines
+['def f(x):', '  if x:', '    return 1', '  return 0']
+>>> body = text.root[1][1]
+>>> body[0] = 'y = x + 1'
+>>> body.append('return y')
+>>> text.update() # (start, old_stop, new_stop)
+[(2, 3, 4)]
+>>> text.lines
+['def f(x):', '  if x:', '    y = x + 1', '    return y', '  return 0']
+"""
+
+from .text import Tree, Node, join_lines, node_is_line, node_is_block, node_is_deferred_line, _IndentCache
+
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+
+LiveNode = 'Union[str, LiveBlock]'
+
+Change = 'Tuple[int, int, int]' # (start, old_stop, new_stop)
+
+
+class LiveBlock:
+	"""
+	A mutable block of lines and nested `LiveBlock`s. Supports the most common list operations.
+	Plain lists assigned into it get converted to `LiveBlock`s.
+	A `LiveBlock` can only be in one place in a tree at a time.
+	"""
+	__slots__ = ('_nodes', '_parent', '_offset', '_line_count', '_dirty', '_stale')
+
+	def __init__(self, nodes: 'Iterable[Union[Node, LiveBlock]]' = ()):
+		self._parent = None
+		self._offset = None # where this block's lines start, relative to the parent's. None if it's never been rendered there
+		self._line_count = 0
+		self._dirty = True  # the nodes of this block changed
+		self._stale = False # some descendant of this block is dirty
+		self._nodes = [self._adopt(node) for node in nodes]
+
+
+	def __len__(self) -> int:
+		return len(self._nodes)
+
+	def __iter__(self) -> 'Iterator[LiveNode]':
+		return iter(self._nodes)
+
+	def __getitem__(self, index: int) -> LiveNode:
+		return self._nodes[index]
+
+	def __setitem__(self, index: int, node: 'Union[Node, LiveBlock]') -> None:
+		node = self._adopt(node)
+		self._disown(self._nodes[index])
+		self._nodes[index] = node
+		self._mark_dirty()
+
+	def __delitem__(self, index: int) -> None:
+		self._disown(self._nodes[index])
+		del self._nodes[index]
+		self._mark_dirty()
+
+	def insert(self, index: int, node: 'Union[Node, LiveBlock]') -> None:
+		self._nodes.insert(index, self._adopt(node))
+		self._mark_dirty()
+
+	def append(self, node: 'Union[Node, LiveBlock]') -> None:
+		self._nodes.append(self._adopt(node))
+		self._mark_dirty()
+
+	def extend(self, nodes: 'Iterable[Union[Node, LiveBlock]]') -> None:
+		self._nodes.extend(self._adopt(node) for node in nodes)
+		self._mark_dirty()
+
+	def pop(self, index: int = -1) -> LiveNode:
+		node = self._nodes.pop(index)
+		self._disown(node)
+		self._mark_dirty()
+		return node
+
+
+	@property
+	def line_count(self) -> int:
+		"The number of lines this block rendered to during the last `LiveText.update()`."
+		return self._line_count
+
+	def to_tree(self) -> Tree:
+		return [node if node_is_line(node) else node.to_tree() for node in self._nodes]
+
+	def __repr__(self) -> str:
+		return '{}({!r})'.format(type(self).__qualname__, self._nodes)
+
+
+	def _adopt(self, node: 'Union[Node, LiveBlock]') -> LiveNode:
+		if node_is_line(node):
+			return node
+		elif node_is_deferred_line(node) and not isinstance(node, str):
+			# Deferred lines (like `rope.Expr`) are turned into strings right away
+			return node.__indented_line__()
+		elif node_is_block(node):
+			node = LiveBlock(node)
+		elif not isinstance(node, LiveBlock):
+			raise TypeError('Expected Node or LiveBlock, got {!r}: {!r}'.format(type(node).__qualname__, node))
+		elif node._parent is not None:
+			raise ValueError('{!r} is already a part of a tree'.format(node))
+		node._parent = self
+		node._offset = None
+		return node
+
+	@staticmethod
+	def _disown(node: LiveNode) -> None:
+		if not node_is_line(node):
+			node._parent = None
+			node._offset = None
+
+	def _mark_dirty(self) -> None:
+		self._dirty = True
+		ancestor = self._parent
+		while ancestor is not None and not ancestor._stale: # (if it's stale, all its ancestors are too)
+			ancestor._stale = True
+			ancestor = ancestor._parent
+
+
+
+class LiveText:
+	"""
+	A text that can be changed through its `root` block and re-rendered incrementally with `update()`.
+	`lines` holds the rendered (indented) lines as of the last update.
+	"""
+	__slots__ = ('root', 'lines', 'indent_string', '_indents')
+
+	def __init__(self, tree: 'Union[Tree, LiveBlock]', indent_string: str = "\t"):
+		self.root = tree if isinstance(tree, LiveBlock) else LiveBlock(tree)
+		if self.root._parent is not None:
+			raise ValueError('{!r} is already a part of a tree'.format(self.root))
+		self.root._offset = 0
+		self.indent_string = indent_string
+		self._indents = _IndentCache(indent_string)
+		self.lines = [] # type: List[str]
+		self.update()
+
+
+	def update(self) -> 'List[Change]':
+		"""
+		Re-renders the blocks that changed since the last update.
+		Returns the changed line ranges as `(start, old_stop, new_stop)` triples:
+		`lines[start:old_stop]` of the previous version got replaced with `lines[start:new_stop]`.
+		The changes are in order, and each one's positions take the previous ones into account
+		(so they can be applied to a copy of the old lines one by one).
+		"""
+		changes = []
+		if self.root._dirty or self.root._stale:
+			self._refresh(self.root, indent_level=0, start=0, changes=changes)
+		return changes
+
+	def flatten(self) -> str:
+		"Updates the text and returns it rendered, like `flatten_tree`."
+		self.update()
+		return join_lines(self.lines)
+
+	def to_tree(self) -> Tree:
+		return self.root.to_tree()
+
+
+	def _refresh(self, block: LiveBlock, indent_level: int, start: int, changes: 'List[Change]') -> None:
+		# `start` is where the block's lines start in `self.lines`, `indent_level` is the level of the block's nodes.
+		if block._dirty:
+			old_line_count = block._line_count
+			new_lines = []
+			self._rebuild(block, indent_level, old_start=start, out=new_lines)
+			self.lines[start:start+old_line_count] = new_lines
+			changes.append((start, start+old_line_count, start+len(new_lines)))
+
+		else: # stale - the block's own lines didn't change, so we only need to visit the dirty descendants
+			pos = start
+			for node in block._nodes:
+				if node_is_line(node):
+					pos += 1
+				else:
+					node._offset = pos - start
+					if node._dirty or node._stale:
+						self._refresh(node, indent_level+1, pos, changes)
+					pos += node._line_count
+			block._line_count = pos - start
+			block._stale = False
+
+
+	def _rebuild(self, block: LiveBlock, indent_level: int, old_start: 'Optional[int]', out: 'List[str]') -> None:
+		"""
+		Renders the block into `out`. Clean nested blocks whose previous lines are known
+		(they're in `self.lines`, at `old_start + offset`) get copied from there instead of rendered.
+		"""
+		indent = self._indents[indent_level]
+		block_start = len(out)
+		for node in block._nodes:
+			if node_is_line(node):
+				out.append(indent + node)
+				continue
+			node_old_start = old_start + node._offset if (old_start is not None and node._offset is not None) else None
+			node._offset = len(out) - block_start
+			if node_old_start is not None and not (node._dirty or node._stale):
+				out.extend(self.lines[node_old_start:node_old_start+node._line_count])
+			else:
+				self._rebuild(node, indent_level+1, node_old_start, out)
+		block._line_count = len(out) - block_start
+		block._dirty = block._stale = False
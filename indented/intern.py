@@ -0,0 +1,171 @@
+"""
+Hash-consing for trees that repeat themselves.
+
+Generated code tends to contain the same lines (`'pass'`, `'return self'`) and the same blocks
+over and over, each one a separate object. An `Interner` deduplicates them as the tree is built:
+equal lines become the same string, and structurally equal blocks become the same `SharedBlock` -
+an immutable list that knows its structural hash and line count.
+`SharedBlock`s are lists, so they work anywhere a block does.
+
+>>> from indented.text import flatten_tree
+>>> interner = Interner()
+>>> a = interner.block(['if x:', ['return self']])
+>>> b = interner.block(['if x:', ['return self']])
+>>> a is b, a[1] is b[1]
+(True, True)
+>>> a.line_count
+2
+>>> flatten_tree(['def f(self):', a, 'def g(self):', b])
+'def f(self):\\n\\tif x:\\n\\t\\treturn self\\ndef g(self):\\n\\tif x:\\n\\t\\treturn self'
+>>> interner.stats()
+{'lines': 2, 'blocks': 2, 'line_hits': 2, 'block_hits': 2}
+
+Because blocks are shared, they can't be changed in place:
+
+>>> a.append('pass')
+Traceback (most recent call last):
+  ...
+TypeError: SharedBlock is immutable (it may be used in many places in a tree)
+
+Sharing also makes `RenderCache` more effective, since it caches blocks by identity.
+"""
+
+from .text import Tree, Node, node_is_line, node_is_block
+
+from typing import Dict, Iterable, List, Tuple, Union
+
+
+class SharedBlock(list):
+	"""
+	An immutable block, shared between all the places where an equal block occurs.
+	Its nodes are strings and other `SharedBlock`s. Usually made by an `Interner`.
+	"""
+	__slots__ = ('_hash', 'line_count')
+
+	def __init__(self, nodes: 'Iterable[Union[str, SharedBlock]]' = ()):
+		list.__init__(self, nodes)
+		line_count = 0
+		for node in self:
+			if node_is_line(node):
+				line_count += 1
+			elif isinstance(node, SharedBlock):
+				line_count += node.line_count
+			else:
+				raise TypeError('SharedBlock can only contain lines and other SharedBlocks, got {!r}: {!r}'.format(type(node).__qualname__, node))
+		self.line_count = line_count
+		# Structural, so equal blocks hash the same even if they come from different `Interner`s
+		self._hash = hash(tuple(node if node_is_line(node) else node._hash for node in self))
+
+	def __hash__(self) -> int:
+		return self._hash
+
+	def __reduce__(self):
+		# The default way of pickling a list subclass would `.extend()` it
+		return (type(self), (list(self),))
+
+	def __repr__(self) -> str:
+		return '{}({})'.format(type(self).__qualname__, list.__repr__(self))
+
+
+def _immutable(name: str):
+	def method(self, *args, **kwargs):
+		raise TypeError('{} is immutable (it may be used in many places in a tree)'.format(type(self).__qualname__))
+	method.__name__ = name
+	return method
+
+for _name in ('__setitem__', '__delitem__', '__iadd__', '__imul__', 'append', 'extend', 'insert', 'pop', 'remove', 'clear', 'sort', 'reverse'):
+	setattr(SharedBlock, _name, _immutable(_name))
+del _name
+
+
+
+class Interner:
+	"""
+	Deduplicates lines and blocks. Keep one around while building a tree,
+	and pass the repetitive parts through it: the duplicates can then be freed right away.
+	The interner keeps everything it has seen alive, so drop it when you're done.
+	"""
+	__slots__ = ('_lines', '_blocks', 'line_hits', 'block_hits')
+
+	def __init__(self):
+		self._lines = {} # type: Dict[str, str]
+		self._blocks = {} # type: Dict[tuple, SharedBlock] # keyed by the lines and ids of the (already interned) nodes
+		self.line_hits = 0
+		self.block_hits = 0
+
+
+	def line(self, line: str) -> str:
+		"Returns the interned version of `line`."
+		interned = self._lines.setdefault(line, line)
+		if interned is not line:
+			self.line_hits += 1
+		return interned
+
+	def block(self, nodes: 'List[Node]') -> SharedBlock:
+		"""
+		Returns the shared version of the block `nodes`,
+		interning all the lines and blocks inside it too (so it takes a walk over `nodes`).
+		"""
+		if not node_is_block(nodes):
+			raise TypeError('Expected a list, got {!r}: {!r}'.format(type(nodes).__qualname__, nodes))
+		stack = [(iter(nodes), [])] # (nodes left, interned nodes) - an explicit stack, so deep trees are fine
+		while True:
+			(nodes_left, interned) = stack[-1]
+			for node in nodes_left:
+				if node_is_line(node):
+					interned.append(self.line(node))
+				elif node_is_block(node):
+					stack.append((iter(node), []))
+					break
+				else:
+					raise TypeError('Only lines and (non-lazy) blocks can be interned, got {!r}: {!r}'.format(type(node).__qualname__, node))
+			else:
+				stack.pop()
+				shared = self._shared_block(interned)
+				if not stack:
+					return shared
+				stack[-1][1].append(shared)
+
+	__call__ = block
+
+
+	def _shared_block(self, nodes: 'List[Union[str, SharedBlock]]') -> SharedBlock:
+		# `nodes` are already interned, so equal blocks are identical, and comparing ids is enough.
+		# (Lines and ids can't be mistaken for one another, they're different types)
+		key = tuple(node if node_is_line(node) else id(node) for node in nodes)
+		shared = self._blocks.get(key)
+		if shared is None:
+			shared = self._blocks[key] = SharedBlock(nodes)
+		else:
+			self.block_hits += 1
+		return shared
+
+
+	def stats(self) -> 'Dict[str, int]':
+		return {
+			'lines': len(self._lines),
+			'blocks': len(self._blocks),
+			'line_hits': self.line_hits,
+			'block_hits': self.block_hits,
+		}
+
+	def clear(self) -> None:
+		self._lines.clear()
+		self._blocks.clear()
+		self.line_hits = self.block_hits = 0
+
+	def __repr__(self) -> str:
+		return '{}({})'.format(type(self).__qualname__, ', '.join('{}={}'.format(k, v) for (k, v) in self.stats().items()))
+
+
+
+def intern_tree(tree: Tree) -> SharedBlock:
+	"""
+	Deduplicates the lines and blocks of an existing tree, with a fresh `Interner`.
+
+	>>> body = ['return self']
+	>>> tree = intern_tree(['if a:', list(body), 'elif b:', list(body)])
+	>>> tree[1] is tree[3]
+	True
+	"""
+	return Interner().block(tree)
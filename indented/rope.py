@@ -0,0 +1,220 @@
+"""
+Deferred expressions, for building deeply nested code without copying strings at every level.
+
+The `codegen` helpers build a new string in each call, so in
+`apply('f', [apply('g', [apply('h', ['x'])])])` the inner parts get copied once per level,
+which gets quadratic for deeply nested expressions.
+The versions in this module (same names and arguments) return an `Expr` instead - a rope that only
+keeps references to its parts, and gets joined into a string once: when it's rendered as a line of a tree
+(or when anything asks for its string value).
+Short expressions made only of strings are cheap to copy, so they stay plain strings (see `LEAF_SIZE`).
+
+>>> e = apply('f', [attr('self', 'x'), item('xs', lit(0))], {'key': tuple_(['a'])})
+>>> e
+'f(self.x, xs[0], key=(a,))'
+>>> e = apply('g', [Expr('long_argument')])
+>>> len(e.parts), type(e.parts[1])
+(3, <class 'indented.rope.Expr'>)
+>>> from indented.text import flatten_tree
+>>> flatten_tree(['def h():', ['return ' + e]])
+'def h():\\n\\treturn g(long_argument)'
+
+`Expr`s mostly behave like strings: they compare, hash, concatenate and format like their string value,
+and have all the `str` methods (which work on the joined string).
+The one exception is `str.join`, which only takes real strings -
+use `str(e)`, or the helpers from this module, which accept both.
+
+>>> e == 'g(long_argument)', e.startswith('g('), '{}!'.format(e)
+(True, True, 'g(long_argument)!')
+
+The `codegen` helpers accept `Expr`s too, however long they get:
+
+>>> from indented import codegen
+>>> long_arg = apply('f', ['x' * LEAF_SIZE])
+>>> type(long_arg).__name__, codegen.apply('g', [long_arg], {'z': long_arg}) == 'g({0}, z={0})'.format(long_arg)
+('Expr', True)
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from .codegen import lit
+
+
+StrOrExpr = 'Union[str, Expr]'
+
+
+class Expr:
+	"""
+	A string made of parts (strings and other `Expr`s), joined only when needed.
+	The result is kept, so it's joined at most once.
+	"""
+	__slots__ = ('parts', '_str')
+
+	def __init__(self, *parts: StrOrExpr):
+		self.parts = parts
+		self._str = None
+
+
+	def __str__(self) -> str:
+		s = self._str
+		if s is None:
+			out = []
+			add = out.append
+			stack = list(reversed(self.parts)) # an explicit stack, so arbitrarily deep expressions are fine
+			(pop, push_all) = (stack.pop, stack.extend)
+			while stack:
+				part = pop()
+				if isinstance(part, str):
+					add(part)
+				elif part._str is not None:
+					add(part._str)
+				else:
+					push_all(reversed(part.parts))
+			s = self._str = ''.join(out)
+			self.parts = (s,) # the parts aren't needed anymore
+		return s
+
+	# Lets the renderers in `indented.text` accept an `Expr` as a line
+	__indented_line__ = __str__
+
+
+	def __add__(self, other: StrOrExpr) -> 'Expr':
+		if isinstance(other, (str, Expr)):
+			return Expr(self, other)
+		return NotImplemented
+
+	def __radd__(self, other: StrOrExpr) -> 'Expr':
+		if isinstance(other, (str, Expr)):
+			return Expr(other, self)
+		return NotImplemented
+
+	def __eq__(self, other) -> bool:
+		if isinstance(other, (str, Expr)):
+			return str(self) == str(other)
+		return NotImplemented
+
+	def __ne__(self, other) -> bool:
+		if isinstance(other, (str, Expr)):
+			return str(self) != str(other)
+		return NotImplemented
+
+	def __hash__(self) -> int:
+		return hash(str(self))
+
+	def __len__(self) -> int:
+		return len(str(self))
+
+	def __iter__(self):
+		return iter(str(self))
+
+	def __getitem__(self, index):
+		return str(self)[index]
+
+	def __contains__(self, sub: str) -> bool:
+		return str(sub) in str(self)
+
+	def __format__(self, spec: str) -> str:
+		return format(str(self), spec)
+
+	def __getattr__(self, name: str):
+		# All the other `str` methods
+		if name.startswith('_'): # (also keeps copy/pickle from recursing on an uninitialized Expr)
+			raise AttributeError(name)
+		return getattr(str(self), name)
+
+	def __reduce__(self):
+		return (type(self), (str(self),))
+
+	def __repr__(self) -> str:
+		return '{}({!r})'.format(type(self).__qualname__, str(self))
+
+
+
+# Short strings are cheap to copy, so the helpers glue together neighbouring string parts,
+# and only make an `Expr` if there's an `Expr` among the parts, or the result would be longer than this.
+# So small expressions stay plain strings, and ropes only form where copying would start to hurt.
+LEAF_SIZE = 256
+
+def _rope(parts: 'List[StrOrExpr]') -> StrOrExpr:
+	merged = []
+	run = [] # consecutive strings
+	for part in parts:
+		if isinstance(part, str):
+			run.append(part)
+		else:
+			if run:
+				merged.append(''.join(run))
+				run = []
+			merged.append(part)
+	if not merged:
+		s = ''.join(run)
+		return s if len(s) <= LEAF_SIZE else Expr(s)
+	if run:
+		merged.append(''.join(run))
+	return Expr(*merged)
+
+
+def _commas(exprs: 'Iterable[StrOrExpr]') -> 'List[StrOrExpr]':
+	"`[a, ', ', b, ', ', c]`"
+	parts = []
+	for expr in exprs:
+		parts.append(expr)
+		parts.append(', ')
+	if parts:
+		parts.pop()
+	return parts
+
+
+def params_str(args: 'Optional[List[StrOrExpr]]' = None, kwargs: 'Union[None, List[Tuple[str, StrOrExpr]], Dict[str, StrOrExpr]]' = None) -> StrOrExpr:
+	return _rope(_params_parts(args, kwargs))
+
+def _params_parts(args: 'Optional[List[StrOrExpr]]', kwargs: 'Union[None, List[Tuple[str, StrOrExpr]], Dict[str, StrOrExpr]]') -> 'List[StrOrExpr]':
+	if kwargs is None:
+		kwargs = ()
+	elif isinstance(kwargs, dict):
+		kwargs = kwargs.items()
+	if args is None:
+		args = ()
+	parts = ['(']
+	for arg in args:
+		parts.append(arg)
+		parts.append(', ')
+	for (name, val) in kwargs:
+		parts.append(name + '=')
+		parts.append(val)
+		parts.append(', ')
+	if len(parts) > 1:
+		parts.pop()
+	parts.append(')')
+	return parts
+
+def apply(func_name: StrOrExpr, args: 'Optional[List[StrOrExpr]]' = None, kwargs: 'Union[None, List[Tuple[str, StrOrExpr]], Dict[str, StrOrExpr]]' = None) -> StrOrExpr:
+	return _rope([func_name, *_params_parts(args, kwargs)])
+
+def tuple_(exprs: 'Iterable[StrOrExpr]', parens: bool = True) -> StrOrExpr:
+	parts = _commas(exprs)
+	if not parts:
+		return '()'
+	if len(parts) == 1:
+		parts.append(',')
+	return _rope(['(', *parts, ')'] if parens else parts)
+
+item   = lambda target, index: _rope([target, '[', index, ']'])
+attr   = lambda target, attr: _rope([target, '.', attr])
+method = lambda target, method, args: _rope([target, '.', method, *_params_parts(args, None)])
+
+list_ = lambda exprs: _rope(['[', *_commas(exprs), ']'])
+dict_ = lambda pairs: _rope(['{', *_commas(_rope([key, ': ', val]) for (key, val) in pairs), '}'])
+set_  = lambda exprs: _rope(['{', *_commas(exprs), '}']) if exprs else 'set()'
+
+
+
+# Change the names of lambdas from '<lambda>' to however
+# they're called in this module for better error messages
+
+func = type(lambda: None)
+n, v = None, None # prevent creating new variables (n, v) during loop, which messes up dict iteration
+for n, v in globals().items():
+	if type(v) is func and v.__name__ == '<lambda>':
+		v.__name__     = n
+		v.__qualname__ = n
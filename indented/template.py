@@ -0,0 +1,188 @@
+"""
+Templates: trees with holes, compiled once into a function that renders them.
+
+When the same shape of code gets generated thousands of times with different names,
+building the nested lists and walking them every time is most of the work.
+A `Template` does the walk once, and compiles the result (with `codegen.eval_def`)
+into a render function that just glues strings together.
+
+Holes inside lines use the `string.Template` syntax - `$name` or `${name}`, and `$$` for a literal `$`
+(braces are a bad choice for Python code, which is full of dict literals).
+A `splice(name)` in place of a node is a hole for a whole sub-tree,
+rendered at the splice's indent level (like `*body` would be).
+
+>>> t = Template([
+...     'class $name:', [
+...         'def __init__(self, $params):', [
+...             splice('body'),
+...         ],
+...         'def __repr__(self):', [
+...             'return f"$name({self.__dict__})"',
+...         ],
+...     ],
+... ], indent_string='  ')
+>>> sorted(t.names), t.splices
+(['name', 'params'], ('body',))
+>>> print(t.render(name='Point', params='x, y', body=['self.x = x', 'self.y = y']))
+class Point:
+  def __init__(self, x, y):
+    self.x = x
+    self.y = y
+  def __repr__(self):
+    return f"Point({self.__dict__})"
+
+The rendered text can go back into a tree as lines (the relative indentation is preserved):
+
+>>> t.lines(name='P', params='', body='pass')[:3]
+['class P:', '  def __init__(self, ):', '    pass']
+"""
+
+import keyword
+import string
+
+from .text import Tree, Node, node_is_line, node_is_block, _IndentCache, _extend_with_lines, flatten_tree
+from .codegen import def_, eval_def
+
+from typing import Any, Callable, List, NamedTuple, Tuple, Union
+
+
+class Splice(NamedTuple):
+	"A hole for a sub-tree in a `Template`. Use `splice(name)`."
+	name: str
+
+splice = Splice
+
+
+class Template:
+	"""
+	A tree with holes, compiled into `render(**bindings) -> str`.
+	Scalar holes accept anything (they're formatted like in an f-string),
+	splices accept a tree or a single line.
+	Hole names can't start with an underscore.
+	"""
+	__slots__ = ('tree', 'indent_string', 'names', 'splices', 'source', 'render')
+
+	def __init__(self, tree: Tree, indent_string: str = "\t"):
+		self.tree = tree
+		self.indent_string = indent_string
+		(pieces, names, splices) = _template_pieces(tree, indent_string)
+		self.names = frozenset(names)
+		self.splices = tuple(splices)
+		self.source = _render_function_source(pieces, names, splices)
+		self.render = eval_def(self.source)(_splice_lines, indent_string) # type: Callable[..., str]
+
+	def lines(self, **bindings) -> 'List[str]':
+		"Renders the template and returns the lines, with the indentation included."
+		return self.render(**bindings).split('\n')
+
+	def __repr__(self) -> str:
+		return '{}({!r})'.format(type(self).__qualname__, self.tree)
+
+
+
+def _template_pieces(tree: Tree, indent_string: str) -> 'Tuple[List[Union[str, Tuple[str, int]]], List[str], List[str]]':
+	"""
+	Walks the template and returns:
+	- a list of pieces: f-string literals for the runs of lines between the splices,
+	  and `(name, indent_level)` for the splices
+	- the scalar hole names and the splice names, in order of appearance
+	"""
+	indents = _IndentCache(indent_string)
+	pieces = []
+	names = []
+	splices = []
+	lines = [] # the f-string-escaped lines of the current run
+	iterators = [iter(tree)]
+	while iterators:
+		indent_level = len(iterators) - 1
+		for node in iterators[-1]:
+			if node_is_line(node):
+				lines.append(_escape_braces(indents[indent_level]) + _line_to_fstring_body(node, names))
+			elif node_is_block(node):
+				iterators.append(iter(node))
+				break
+			elif isinstance(node, Splice):
+				_check_hole_name(node.name, node)
+				if lines:
+					pieces.append('f' + repr('\n'.join(lines)))
+					lines = []
+				pieces.append((node.name, indent_level))
+				if node.name not in splices:
+					splices.append(node.name)
+			else:
+				raise TypeError('Expected Node or Splice, got {!r}: {!r}'.format(type(node).__qualname__, node))
+		else:
+			iterators.pop()
+	if lines:
+		pieces.append('f' + repr('\n'.join(lines)))
+	overlap = set(names) & set(splices)
+	if overlap:
+		raise ValueError('Names used both as a scalar hole and a splice: {}'.format(', '.join(sorted(overlap))))
+	return (pieces, names, splices)
+
+
+def _line_to_fstring_body(line: str, names: 'List[str]') -> str:
+	"Turns the `$`-holes of `line` into f-string fields, escaping everything else. Adds new hole names to `names`."
+	parts = []
+	pos = 0
+	for match in string.Template.pattern.finditer(line):
+		parts.append(_escape_braces(line[pos:match.start()]))
+		pos = match.end()
+		if match.group('escaped') is not None:
+			parts.append('$')
+			continue
+		name = match.group('named') or match.group('braced')
+		if name is None:
+			raise ValueError('Invalid placeholder at column {} in template line {!r}'.format(match.start('invalid'), line))
+		_check_hole_name(name, line)
+		if name not in names:
+			names.append(name)
+		parts.append('{' + name + '}')
+	parts.append(_escape_braces(line[pos:]))
+	return ''.join(parts)
+
+_escape_braces = lambda s: s.replace('{', '{{').replace('}', '}}')
+
+def _check_hole_name(name: str, context: Any) -> None:
+	if not name.isidentifier() or keyword.iskeyword(name) or name.startswith('_'):
+		raise ValueError('Invalid hole name {!r} (in {!r}): must be an identifier, not a keyword, and not start with an underscore'.format(name, context))
+
+
+def _render_function_source(pieces: 'List[Union[str, Tuple[str, int]]]', names: 'List[str]', splices: 'List[str]') -> str:
+	params = ['*', *names, *splices] if (names or splices) else []
+	if not splices:
+		body = ['return ' + (pieces[0] if pieces else "''")]
+	else:
+		body = ['_pieces = []']
+		for piece in pieces:
+			if isinstance(piece, tuple):
+				(name, indent_level) = piece
+				body.append('_splice_lines(_pieces, {}, {}, _indent_string)'.format(name, indent_level))
+			else:
+				body.append('_pieces.append({})'.format(piece))
+		body.append("return '\\n'.join(_pieces)")
+	return flatten_tree([
+		def_('_make_render', ['_splice_lines', '_indent_string']), [
+			def_('render', params), body,
+			'return render',
+		],
+	])
+
+
+def _splice_lines(pieces: 'List[str]', value: 'Union[str, Tree]', indent_level: int, indent_string: str) -> None:
+	if node_is_line(value):
+		pieces.append(indent_string * indent_level + value)
+	elif node_is_block(value):
+		if not value:
+			return
+		indent = indent_string * indent_level
+		try:
+			# The common case - a flat list of lines (or `Snippet`s, which is why the indent goes in after joining)
+			pieces.append(indent + '\n'.join(value).replace('\n', '\n' + indent) if indent else '\n'.join(value))
+		except TypeError: # there's a nested block in there
+			lines = []
+			_extend_with_lines(lines, value, indent_level, indent_string)
+			if lines:
+				pieces.append('\n'.join(lines))
+	else:
+		raise TypeError('A splice expects a tree or a line, got {!r}: {!r}'.format(type(value).__qualname__, value))
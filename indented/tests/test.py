@@ -12,8 +12,15 @@ def run_doctests():
 	import doctest
 	from indented import text
 	from indented import codegen
-
-	for mod in (text, codegen):
+	from indented import incremental
+	from indented import intern
+	from indented import template
+	from indented import instrument
+	from indented import rope
+	from indented import astgen
+	from indented import importer
+
+	for mod in (text, codegen, incremental, intern, template, instrument, rope, astgen, importer):
 		failure_count, test_count = doctest.testmod(mod)
 		if failure_count == 0:
 			print("{mod.__name__}: ran {test_count} tests, passed everything".format(**locals()))
@@ -48,28 +48,108 @@ As a `typing` type it's
 
 	Text = List[ Union[String, Text] ]
 
+Blocks can also be lazy - instead of a list, you can use an iterator (e.g. a generator)
+or a zero-argument function returning an iterable of nodes. Lazy blocks get expanded
+only when the walk reaches them, so a huge text doesn't have to exist in memory all at once.
+They're supported by `iter_lines_with_indent_level` and everything built on it
+(`flatten_tree`, `iter_chunks`, `write_tree`, ...).
+Note that an iterator can only be expanded once.
+
+A line can't contain newlines, but a `Snippet` can: it's a multi-line string node
+(an embedded block of code, a docstring...) that gets re-indented as a whole when rendered.
+See `Snippet` for details.
+
 """
 
 
 
 
+import codecs as _codecs
 import itertools
-
-# TODO: Consider supporting multi-line strings of code
+import os as _os
+import sys as _sys
+import time as _time
+from array import array as _array
+from bisect import bisect_right as _bisect_right
+from collections import OrderedDict as _OrderedDict, namedtuple as _namedtuple
 
 
 Node = 'Union[str, List[Node]]'
 node_is_line  = lambda n: type(n) is str
-node_is_block = lambda n: type(n) is list
+node_is_block = lambda n: type(n) is list or isinstance(n, list) # (subclasses, like `intern.SharedBlock`, are rare - check the common case first)
 is_node = lambda x: node_is_line(x) or node_is_block(x)
+node_is_lazy = lambda n: type(n) is not str and type(n) is not list and (callable(n) or hasattr(n, '__next__'))
+# Objects that turn into a line when rendered (like `indented.rope.Expr`) - they define `__indented_line__() -> str`.
+# Renderers only check for them after everything else, so they don't slow down the common case.
+node_is_deferred_line = lambda n: hasattr(type(n), '__indented_line__')
 
 Tree = 'List[Node]'
 
 
 
-def flatten_tree(tree: Tree) -> str:
+class Snippet(str):
+	"""
+	A multi-line node. It renders like the lines it contains, all at the snippet's indent level,
+	but without splitting it up: the indent gets inserted after each newline, in one `str.replace`.
+	With `dedent=True`, the common leading whitespace is removed first (with `textwrap.dedent`),
+	along with the newlines at the start and end - handy for triple-quoted strings.
+
+	>>> body = Snippet('''
+	...     x = 1
+	...     if x:
+	...         return x
+	... ''', dedent=True)
+	>>> print(join_lines(indented_lines(['def f():', [body]], indent_string='  ')))
+	def f():
+	  x = 1
+	  if x:
+	      return x
+	>>> body.line_count
+	3
+
+	It's still one node, so the line-by-line functions (`iter_lines_with_indent_level`, `indented_lines`)
+	yield it as one item, with the newlines inside. Adding an indent to it (`indent + snippet`)
+	indents all of its lines, so the usual `indent_string * indent_level + line` does the right thing.
+	`count_lines`, `rendered_size` and `tree_stats` count the actual lines.
+	`LineIndex` doesn't support snippets.
+	"""
+	__slots__ = ()
+
+	def __new__(cls, text: str = '', dedent: bool = False) -> 'Snippet':
+		if dedent:
+			import textwrap # (only imported when needed, it's not free)
+			text = textwrap.dedent(text).strip('\n')
+		return str.__new__(cls, text)
+
+	@property
+	def line_count(self) -> int:
+		return self.count('\n') + 1
+
+	def __indented_line__(self) -> 'Snippet':
+		# Lets all the renderers accept a snippet as a node - the indentation is handled by `__radd__`
+		return self
+
+	def __radd__(self, prefix: str) -> str:
+		# Python tries this before `str.__add__`, because Snippet is a subclass of str.
+		# Only whitespace (after the prefix's last newline) counts as an indent -
+		# `'x = ' + snippet` is just a concatenation.
+		if type(prefix) is not str:
+			return NotImplemented
+		indent = prefix[prefix.rfind('\n')+1:]
+		if indent and indent.isspace():
+			return prefix + self.replace('\n', '\n' + indent)
+		return prefix + str(self)
+
+	def __repr__(self) -> str:
+		return '{}({})'.format(type(self).__qualname__, str.__repr__(self))
+
+
+
+def flatten_tree(tree: Tree, cache: 'Optional[RenderCache]' = None) -> str:
 	# return lines_to_source(tree_to_lines_rec(tree))
-	return join_lines(iter_indented_lines(tree))
+	if _render_hooks:
+		return _instrumented_flatten_tree(tree, cache)
+	return join_lines(iter_indented_lines(tree, cache=cache))
 		
 flatten = flatten_tree
 
@@ -86,7 +166,9 @@ def join_lines(lines: 'Iterable[str]') -> str:
 join = join_lines
 
 
-def iter_indented_lines(tree: Tree, indent_level_offset: int = 0, indent_string: str = "\t") -> 'Iterator[str]':
+def iter_indented_lines(tree: Tree, indent_level_offset: int = 0, indent_string: str = "\t", cache: 'Optional[RenderCache]' = None) -> 'Iterator[str]':
+	if cache is not None:
+		return iter(cache.indented_lines(tree, indent_string=indent_string))
 	return (indent_string*indent_level+line for (indent_level, line) in iter_lines_with_indent_level(tree))
 
 
@@ -134,14 +216,39 @@ def iter_lines_with_indent_level(tree: Tree, indent_level_offset: int = 0) -> 'I
 	(2, 'dddd')
 	(1, 'eeee')
 
+	Lazy blocks are expanded as they're reached:
+
+	>>> def rows():
+	...     for i in range(2):
+	...         yield 'row_{}'.format(i)
+	...         yield lambda: ['(details)']
+	>>> for x in iter_lines_with_indent_level(['rows:', rows()]):
+	...     print(x)
+	...
+	(0, 'rows:')
+	(1, 'row_0')
+	(2, '(details)')
+	(1, 'row_1')
+	(2, '(details)')
+
 	"""
+	if _render_hooks:
+		return _instrumented_iter_lines(tree, indent_level_offset)
+	return _iter_lines_with_indent_level(tree, indent_level_offset)
+
+
+def _iter_lines_with_indent_level(tree: Tree, indent_level_offset: int) -> 'Iterator[Tuple[int, str]]':
 	# (it's way cleaner in the recursive version, as you'd expect from a function on trees)  
 
 	indent_level = indent_level_offset
 
-	# the stack will contain either Nodes or block markers which signify that a block begun or ended (defined below)
+	# the stack will contain either Nodes, block markers which signify that a block begun or ended (defined below),
+	# or `_LazyBlockIterator`s for lazy blocks which are being expanded.
 	stack = [] 
-	stack.extend(reversed(tree)) # earlier nodes go closer to the left - the top of the stack
+	if node_is_block(tree):
+		stack.extend(reversed(tree)) # earlier nodes go closer to the left - the top of the stack
+	else:
+		stack.append(_LazyBlockIterator(tree))
 	# Alternatively, we could have two stacks - one for nodes and one for indents.
 	# In that case when encountering a block, we'd push as many (indent_level+1)'s
 
@@ -175,35 +282,1374 @@ def iter_lines_with_indent_level(tree: Tree, indent_level_offset: int = 0) -> 'I
 
 			else: raise TypeError('Expected Node, got {!r}: {!r}'.format(type(node).__qualname__, node))
 
+		elif type(node_or_block_marker) is _LazyBlockIterator:
+			lazy_block = node_or_block_marker
+			node = next(lazy_block.nodes, _EXHAUSTED)
+			if node is not _EXHAUSTED:
+				if not (is_node(node) or node_is_lazy(node) or node_is_deferred_line(node)):
+					raise TypeError('Expected Node, got {!r}: {!r} (yielded by lazy block {!r})'.format(type(node).__qualname__, node, lazy_block.source))
+				stack.append(lazy_block) # come back for the next one after this node's done
+				stack.append(node)
+
+		elif node_is_lazy(node_or_block_marker):
+			stack.append(BLOCK_END)
+			stack.append(_LazyBlockIterator(node_or_block_marker))
+			stack.append(BLOCK_START)
+
+		elif node_is_deferred_line(node_or_block_marker):
+			yield (indent_level, node_or_block_marker.__indented_line__())
+
 		else:
 			unknown = node_or_block_marker
 			raise TypeError('Unexpected value of type {!r}: {!r}'.format(type(unknown).__qualname__, unknown))
 
 
+_EXHAUSTED = object()
 
+class _LazyBlockIterator:
+	"The state of a lazy block that's being expanded by `iter_lines_with_indent_level`."
+	__slots__ = ('nodes', 'source')
 
-# Recursive version of the above - less efficient, but way easier to verify
+	def __init__(self, source: 'Union[Iterator[Node], Callable[[], Iterable[Node]]]'):
+		self.source = source
+		nodes = source() if callable(source) else source
+		if type(nodes) is str:
+			raise TypeError('Expected an iterable of Nodes, got a string: {!r} (returned by lazy block {!r})'.format(nodes, source))
+		self.nodes = iter(nodes)
 
-def indented_lines_rec(tree: Tree, indent_level: int = 0, indent_string: str = "\t") -> 'List[str]':
-	return \
-		concat_lists(
-			_node_to_lines(node, indent_level=indent_level, indent_string=indent_string)
-			for node in tree
+
+
+
+# Streaming output
+
+DEFAULT_BUFFER_SIZE = 64 * 1024 # in characters
+
+
+class _IndentCache(dict):
+	"""
+	Maps indent levels to indent prefixes, building each prefix only once.
+
+	>>> indents = _IndentCache('  ')
+	>>> indents[0], indents[2]
+	('', '    ')
+	"""
+	__slots__ = ('indent_string',)
+
+	def __init__(self, indent_string: str):
+		super().__init__()
+		self.indent_string = indent_string
+
+	def __missing__(self, indent_level: int) -> str:
+		prefix = self[indent_level] = self.indent_string * indent_level
+		return prefix
+
+
+
+def iter_chunks(tree: Tree, indent_string: str = "\t", buffer_size: int = DEFAULT_BUFFER_SIZE, max_lines: 'Optional[int]' = None) -> 'Iterator[str]':
+	"""
+	Returns an iterator of consecutive pieces of `flatten_tree(tree)`,
+	each roughly `buffer_size` characters long (a chunk always ends on a whole line),
+	and at most `max_lines` lines long, if that's given.
+	Only one chunk is kept in memory at a time.
+
+	>>> list(iter_chunks(['aaaa', ['bbbb', 'cccc']], indent_string='  ', buffer_size=10))
+	['aaaa\\n  bbbb', '\\n  cccc']
+	>>> list(iter_chunks(['aaaa', ['bbbb', 'cccc']], indent_string='  ', max_lines=2))
+	['aaaa\\n  bbbb', '\\n  cccc']
+	>>> str.join('', iter_chunks(['aaaa', ['bbbb', 'cccc']])) == flatten_tree(['aaaa', ['bbbb', 'cccc']])
+	True
+	>>> list(iter_chunks(['aaaa', (x for x in [1])])) # doctest: +ELLIPSIS
+	Traceback (most recent call last):
+	...
+	TypeError: Expected Node, got 'int': 1 (yielded by lazy block <generator object ...>)
+	"""
+	indents = _IndentCache(indent_string)
+	chunk = []
+	add_line = chunk.append
+	chunk_size = 0
+	lines_left = max_lines or -1 # never reaches 0 if there's no limit
+	separator = '' # the newline between the previous chunk and the current one
+
+	# Same walk as `FlatText.extend_tree` (no `iter_lines_with_indent_level` generator in the way).
+	# Lazy blocks are iterators of nodes too, so they go on the same stack as the blocks
+	# (with the `_LazyBlockIterator` on a parallel stack, for the error messages).
+	indent_level = 0
+	indent = ''
+	lazy_blocks = [None if node_is_block(tree) else _LazyBlockIterator(tree)]
+	iterators = [iter(tree) if lazy_blocks[0] is None else lazy_blocks[0].nodes]
+	while iterators:
+		for node in iterators[-1]:
+			if node_is_line(node):
+				line = indent + node
+			elif node_is_block(node):
+				iterators.append(iter(node))
+				lazy_blocks.append(None)
+				indent_level += 1
+				indent = indents[indent_level]
+				break
+			elif node_is_lazy(node):
+				lazy_block = _LazyBlockIterator(node)
+				iterators.append(lazy_block.nodes)
+				lazy_blocks.append(lazy_block)
+				indent_level += 1
+				indent = indents[indent_level]
+				break
+			elif node_is_deferred_line(node):
+				line = indent + node.__indented_line__()
+			elif lazy_blocks[-1] is not None:
+				raise TypeError('Expected Node, got {!r}: {!r} (yielded by lazy block {!r})'.format(type(node).__qualname__, node, lazy_blocks[-1].source))
+			else: raise TypeError('Expected Node, got {!r}: {!r}'.format(type(node).__qualname__, node))
+			add_line(line)
+			chunk_size += len(line) + 1
+			lines_left -= 1
+			if chunk_size >= buffer_size or not lines_left:
+				yield separator + join_lines(chunk)
+				separator = '\n'
+				chunk.clear()
+				chunk_size = 0
+				lines_left = max_lines or -1
+		else:
+			iterators.pop()
+			lazy_blocks.pop()
+			indent_level -= 1
+			indent = indents[indent_level] if indent_level >= 0 else ''
+
+	if chunk:
+		yield separator + join_lines(chunk)
+
+
+def write_tree(tree: Tree, file: 'Union[IO, Callable[[str], Any]]', indent_string: str = "\t", buffer_size: int = DEFAULT_BUFFER_SIZE, encoding: 'Optional[str]' = None) -> int:
+	"""
+	Writes `flatten_tree(tree)` to `file` without building the whole string in memory.
+	`file` can be a file-like object or just a `write` function.
+	If `encoding` is given, the chunks are encoded before being written (with one incremental encoder,
+	so encodings with a BOM only write it once), and `file` can be opened in binary mode
+	(or be a socket's `sendall`).
+	Returns the number of characters written.
+
+	>>> import io
+	>>> f = io.StringIO()
+	>>> write_tree(['aaaa', ['bbbb']], f, indent_string='  ')
+	11
+	>>> f.getvalue()
+	'aaaa\\n  bbbb'
+
+	>>> chunks = []
+	>>> write_tree(['aaaa', ['bbbb']], chunks.append, encoding='utf-8')
+	10
+	>>> chunks
+	[b'aaaa\\n\\tbbbb']
+	>>> chunks = []
+	>>> _ = write_tree(['aaaa', ['bbbb']], chunks.append, buffer_size=1, encoding='utf-8-sig')
+	>>> b''.join(chunks).decode('utf-8-sig') == flatten_tree(['aaaa', ['bbbb']])
+	True
+	"""
+	write = file if callable(file) else file.write
+	written = 0
+	encode = _codecs.getincrementalencoder(encoding)().encode if encoding is not None else None
+	for chunk in iter_chunks(tree, indent_string=indent_string, buffer_size=buffer_size):
+		written += len(chunk)
+		write(chunk if encode is None else encode(chunk))
+	if encode is not None:
+		rest = encode('', final=True) # (stateful encodings may have something left)
+		if rest:
+			write(rest)
+	return written
+
+
+
+
+# Bytes output
+
+def _decode_indent(indent: bytes, encoding: str) -> str:
+	"""
+	Checks that lines can be encoded one by one with `encoding` (so not with ones that add a BOM,
+	like 'utf-16' - use 'utf-16-le' or 'utf-16-be'), and that `indent` is valid in it.
+	Returns the indent as a string.
+	"""
+	if ('a' + '\n').encode(encoding) != 'a'.encode(encoding) + '\n'.encode(encoding):
+		raise ValueError("Can't render to {!r} piece by piece, it's a stateful encoding (like one that adds a BOM)".format(encoding))
+	try:
+		indent_string = indent.decode(encoding)
+	except UnicodeDecodeError:
+		raise ValueError('The indent {!r} is not valid {!r}, it should be encoded with the same encoding as the output'.format(indent, encoding)) from None
+	return indent_string
+
+def rendered_size(tree: Tree, indent: bytes = b"\t", encoding: str = 'utf-8') -> int:
+	"""
+	Returns the length of `flatten_tree(tree)` encoded with `encoding` (and with `indent` instead of tabs),
+	without rendering it.
+	Stateful encodings (like 'utf-16', which starts with a BOM) aren't supported, use e.g. 'utf-16-le'.
+
+	>>> rendered_size(['aaaa', ['bbbb']]), rendered_size(['\u0105'])
+	(10, 2)
+	>>> rendered_size(['aaaa', ['bbbb']], indent='\\t'.encode('utf-16-le'), encoding='utf-16-le')
+	20
+	>>> rendered_size(['aaaa'], encoding='utf-16')
+	Traceback (most recent call last):
+	...
+	ValueError: Can't render to 'utf-16' piece by piece, it's a stateful encoding (like one that adds a BOM)
+	"""
+	_decode_indent(indent, encoding)
+	newline = '\n'.encode(encoding)
+	# For ASCII-compatible encodings, an ASCII string encodes to the same number of bytes,
+	# so most lines don't have to be encoded just to get their length.
+	ascii_compatible = ('a'.encode(encoding) == b'a')
+	size = 0
+	n_lines = 0
+	for (indent_level, line) in iter_lines_with_indent_level(tree):
+		n_lines += 1
+		size += len(indent) * indent_level + (len(line) if ascii_compatible and line.isascii() else len(line.encode(encoding)))
+		if type(line) is Snippet:
+			# its newlines are already counted, but every line after the first one gets an indent too
+			size += len(indent) * indent_level * line.count('\n')
+	return size + len(newline) * max(n_lines - 1, 0)
+
+
+
+def render_bytes(tree: Tree, indent: bytes = b"\t", encoding: str = 'utf-8', out: 'Optional[Buffer]' = None, size: 'Optional[int]' = None) -> memoryview:
+	"""
+	Renders the tree straight to encoded bytes, in one allocation:
+	first it counts how many bytes the output will take (see `rendered_size`),
+	then it allocates a `bytearray` of exactly that size and fills it in place.
+	Unlike `flatten_tree(tree).encode(...)`, which builds a list of lines, a string, and then the bytes,
+	the peak memory use is just the output. (The price is walking the tree twice, so it's a bit slower)
+
+	You can also pass a writable buffer as `out` (a `bytearray`, an `mmap`, ...)
+	to render into - it needs to be at least `size` bytes long. If you know the `size` already,
+	passing it skips the counting pass.
+	Returns a `memoryview` of the rendered bytes.
+
+	Since the tree is walked twice, lazy blocks have to produce the same nodes each time
+	(i.e. be functions rather than iterators). Like in `rendered_size`, `indent` has to be encoded
+	with `encoding`, and the encoding can't be a stateful one.
+
+	>>> bytes(render_bytes(['aaaa', ['bbbb']], indent=b'  '))
+	b'aaaa\\n  bbbb'
+	>>> buf = bytearray(16)
+	>>> render_bytes(['\u0105', ['b']], out=buf).tobytes()
+	b'\\xc4\\x85\\n\\tb'
+	"""
+	indent_string = _decode_indent(indent, encoding)
+	if size is None:
+		size = rendered_size(tree, indent=indent, encoding=encoding)
+	if out is None:
+		out = bytearray(size)
+	view = memoryview(out).cast('B')
+	if len(view) < size:
+		raise ValueError('The output buffer is too small: the tree needs {} bytes, but the buffer only has {}'.format(size, len(view)))
+
+	view = view[:size]
+
+	# For each indent level, what goes before a line - a newline and the indent.
+	# (Encoding the prefix together with the line is faster than copying them into the buffer separately)
+	prefixes = _IndentCache(indent_string)
+	newline_prefixes = {}
+	pos = 0
+	lines = iter_lines_with_indent_level(tree)
+	changed_error = 'The tree rendered to {} bytes instead of the expected {} - did it change after its size was computed?'
+
+	for (indent_level, line) in lines:
+		# the first line doesn't have a newline before it
+		data = (prefixes[indent_level] + line).encode(encoding)
+		pos = len(data)
+		if pos > size:
+			raise ValueError(changed_error.format('more than '+str(size), size))
+		view[:pos] = data
+		break
+
+	for (indent_level, line) in lines:
+		prefix = newline_prefixes.get(indent_level)
+		if prefix is None:
+			prefix = newline_prefixes[indent_level] = '\n' + prefixes[indent_level]
+		data = (prefix + line).encode(encoding)
+		start = pos
+		pos += len(data)
+		if pos > size:
+			raise ValueError(changed_error.format('more than '+str(size), size))
+		view[start:pos] = data
+
+	if pos != size:
+		raise ValueError(changed_error.format(pos, size))
+	return view
+
+
+
+
+# Writing files only if they changed
+
+class FileEmitter:
+	"""
+	Writes rendered trees to files, but leaves a file alone if it already has exactly that content,
+	so its mtime doesn't change and whatever watches it doesn't have to redo any work.
+
+	The tree is first rendered only to compute its size and hash, and compared with the file:
+	if the sizes differ, the file has to be rewritten. Otherwise the hashes are compared -
+	the file's is either read from a sidecar `<path>.digest` file (if `sidecar` is enabled,
+	and the sidecar matches the file's size and mtime), or computed by reading the file.
+	If the file needs to be rewritten, the tree is rendered again, into a temporary file
+	which then atomically replaces the old one.
+	(Because the tree may be rendered twice, lazy blocks should be functions rather than iterators)
+
+	>>> import os, tempfile
+	>>> temp_dir = tempfile.TemporaryDirectory()
+	>>> path = os.path.join(temp_dir.name, 'generated.py')
+	>>> emitter = FileEmitter()
+	>>> emitter.emit(['def f():', ['return 1']], path)
+	True
+	>>> emitter.emit(['def f():', ['return 1']], path)
+	False
+	>>> emitter.emit(['def f():', ['return 2']], path)
+	True
+	>>> (emitter.written, emitter.skipped)
+	(2, 1)
+	>>> emitter = FileEmitter(encoding='utf-16')
+	>>> emitter.emit(['def f():', ['return 1']], path), emitter.emit(['def f():', ['return 1']], path)
+	(True, False)
+	>>> temp_dir.cleanup()
+	"""
+	__slots__ = ('indent_string', 'encoding', 'sidecar', 'written', 'skipped')
+
+	def __init__(self, indent_string: str = "\t", encoding: str = 'utf-8', sidecar: bool = False):
+		self.indent_string = indent_string
+		self.encoding = encoding
+		self.sidecar = sidecar
+		self.written = self.skipped = 0
+
+
+	def emit(self, tree: Tree, path: str) -> bool:
+		"Writes the rendered tree to `path`, unless the file's content is already the same. Returns whether it wrote the file."
+		(size, digest) = self._digest_tree(tree)
+		if self._file_matches(path, size, digest):
+			self.skipped += 1
+			return False
+		self._write(tree, path)
+		if self.sidecar:
+			self._write_sidecar(path, digest)
+		self.written += 1
+		return True
+
+
+	@staticmethod
+	def _hash() -> 'hashlib.blake2b':
+		import hashlib # not at the top, `hashlib` takes a while to import
+		return hashlib.blake2b(digest_size=32)
+
+	_READ_SIZE = 1024 * 1024
+
+	def _digest_tree(self, tree: Tree) -> 'Tuple[int, str]':
+		h = self._hash()
+		size = 0
+		# one encoder for the whole tree, like the text file the tree gets written to (so a BOM is only counted once)
+		encode = _codecs.getincrementalencoder(self.encoding)().encode
+		for chunk in iter_chunks(tree, indent_string=self.indent_string):
+			data = encode(chunk)
+			size += len(data)
+			h.update(data)
+		data = encode('', final=True)
+		size += len(data)
+		h.update(data)
+		return (size, h.hexdigest())
+
+	def _file_matches(self, path: str, size: int, digest: str) -> bool:
+		try:
+			stat = _os.stat(path)
+		except FileNotFoundError:
+			return False
+		if stat.st_size != size:
+			return False
+		if self.sidecar:
+			sidecar_digest = self._read_sidecar(path, stat)
+			if sidecar_digest is not None:
+				return sidecar_digest == digest
+		h = self._hash()
+		with open(path, 'rb') as f:
+			for data in iter(lambda: f.read(self._READ_SIZE), b''):
+				h.update(data)
+		file_digest = h.hexdigest()
+		if self.sidecar:
+			self._write_sidecar(path, file_digest)
+		return file_digest == digest
+
+	def _write(self, tree: Tree, path: str) -> None:
+		try:
+			mode = _os.stat(path).st_mode & 0o7777 # keep the permissions of the file we're replacing
+		except FileNotFoundError:
+			mode = None
+		temp_path = _temp_path_for(path)
+		# 0o666 is filtered through the umask, just like when a file is created by `open`
+		fd = _os.open(temp_path, _os.O_WRONLY | _os.O_CREAT | _os.O_EXCL, 0o666)
+		try:
+			with open(fd, 'w', encoding=self.encoding, newline='') as f:
+				write_tree(tree, f, indent_string=self.indent_string)
+			if mode is not None:
+				_os.chmod(temp_path, mode)
+			_os.replace(temp_path, path)
+		except BaseException:
+			try: _os.unlink(temp_path)
+			except OSError: pass
+			raise
+
+
+	# The sidecar holds "<size> <mtime_ns> <digest>" of the file it describes,
+	# so we can tell if the file was modified by someone else since.
+
+	_sidecar_path = staticmethod(lambda path: path + '.digest')
+
+	def _read_sidecar(self, path: str, stat: '_os.stat_result') -> 'Optional[str]':
+		try:
+			with open(self._sidecar_path(path), 'r', encoding='ascii') as f:
+				(size, mtime_ns, digest) = f.read().split()
+		except (OSError, ValueError):
+			return None
+		if (int(size), int(mtime_ns)) != (stat.st_size, stat.st_mtime_ns):
+			return None
+		return digest
+
+	def _write_sidecar(self, path: str, digest: str) -> None:
+		stat = _os.stat(path)
+		sidecar_path = self._sidecar_path(path)
+		temp_path = _temp_path_for(sidecar_path)
+		with open(temp_path, 'x', encoding='ascii') as f:
+			f.write('{} {} {}\n'.format(stat.st_size, stat.st_mtime_ns, digest))
+		_os.replace(temp_path, sidecar_path)
+
+
+	def stats(self) -> 'Dict[str, int]':
+		return dict(written=self.written, skipped=self.skipped)
+
+	def __repr__(self) -> str:
+		return '{}(indent_string={!r}, encoding={!r}, sidecar={!r}) <{}>'.format(type(self).__qualname__, self.indent_string, self.encoding, self.sidecar, self.stats())
+
+
+def write_tree_if_changed(tree: Tree, path: str, indent_string: str = "\t", encoding: str = 'utf-8', sidecar: bool = False) -> bool:
+	"Writes the rendered tree to `path`, unless the file's content is already the same. Returns whether it wrote the file. See `FileEmitter`."
+	return FileEmitter(indent_string=indent_string, encoding=encoding, sidecar=sidecar).emit(tree, path)
+
+
+_temp_counter = itertools.count()
+
+def _temp_path_for(path: str) -> str:
+	"A temporary file name in the same directory as `path` (so that `os.replace` can be atomic)"
+	(directory, name) = _os.path.split(path)
+	return _os.path.join(directory, '.{}.{}.{}.tmp'.format(name, _os.getpid(), next(_temp_counter)))
+
+
+
+
+# Asyncio support
+
+DEFAULT_ASYNC_MAX_LINES = 1000
+
+
+async def aiter_chunks(tree: Tree, indent_string: str = "\t", max_lines: int = DEFAULT_ASYNC_MAX_LINES, buffer_size: int = DEFAULT_BUFFER_SIZE) -> 'AsyncIterator[str]':
+	"""
+	An async version of `iter_chunks`, for rendering big trees without blocking the event loop.
+	After every chunk (at most `max_lines` lines), control goes back to the loop,
+	even if the consumer doesn't await anything itself.
+
+	>>> import asyncio
+	>>> async def collect(tree):
+	...     return [chunk async for chunk in aiter_chunks(tree, max_lines=1)]
+	>>> asyncio.run(collect(['aaaa', ['bbbb']]))
+	['aaaa', '\\n\\tbbbb']
+	"""
+	import asyncio
+	for chunk in iter_chunks(tree, indent_string=indent_string, buffer_size=buffer_size, max_lines=max_lines):
+		yield chunk
+		await asyncio.sleep(0)
+
+
+
+async def write_tree_async(tree: Tree, writer: 'asyncio.StreamWriter', indent_string: str = "\t", encoding: str = 'utf-8', max_lines: int = DEFAULT_ASYNC_MAX_LINES, buffer_size: int = DEFAULT_BUFFER_SIZE) -> int:
+	"""
+	Writes `flatten_tree(tree)` to an `asyncio.StreamWriter` (or anything with `write` and `drain`)
+	chunk by chunk, waiting on `drain()` after each one, so a slow client
+	doesn't make us buffer the whole output.
+	Returns the number of characters written.
+
+	>>> import asyncio
+	>>> class Writer:
+	...     def __init__(self): self.data = b''
+	...     def write(self, data): self.data += data
+	...     async def drain(self): pass
+	>>> writer = Writer()
+	>>> asyncio.run(write_tree_async(['aaaa', ['bbbb']], writer))
+	10
+	>>> writer.data
+	b'aaaa\\n\\tbbbb'
+	>>> writer = Writer()
+	>>> _ = asyncio.run(write_tree_async(['aaaa', ['bbbb']], writer, encoding='utf-16', buffer_size=1))
+	>>> writer.data == flatten_tree(['aaaa', ['bbbb']]).encode('utf-16')
+	True
+	"""
+	written = 0
+	encode = _codecs.getincrementalencoder(encoding)().encode
+	async for chunk in aiter_chunks(tree, indent_string=indent_string, max_lines=max_lines, buffer_size=buffer_size):
+		writer.write(encode(chunk))
+		written += len(chunk)
+		await writer.drain()
+	rest = encode('', final=True)
+	if rest:
+		writer.write(rest)
+		await writer.drain()
+	return written
+
+
+
+
+# Parallel rendering
+
+def flatten_parallel(tree: Tree, workers: 'Optional[int]' = None, executor: 'Optional[Executor]' = None, chunks_per_worker: int = 4) -> str:
+	"""
+	Same as `flatten_tree(tree)`, but the top-level nodes are split into contiguous chunks
+	of roughly the same number of lines, and rendered in parallel.
+
+	By default, a process pool with `workers` processes is started for the call.
+	Where possible, the processes are forked, so they inherit the tree instead of getting it pickled.
+	On free-threaded builds, where threads can actually run in parallel, threads are used instead.
+	You can also pass an `executor` to reuse an existing pool, but with a process pool
+	that means pickling the chunks, which costs about as much as rendering them.
+
+	Only worth it for big trees (see the `flatten_parallel` benchmark for where the crossover is).
+	Lazy blocks can't be pickled, so they're only supported with threads and forked processes.
+	Forking a process that has other threads running can deadlock the workers (if a lock was held
+	during the fork), so in threaded programs, pass a thread or process pool as `executor`.
+
+	>>> tree = ['aaaa', ['bbbb'], 'cccc', [], '', ['dddd']]
+	>>> from concurrent.futures import ThreadPoolExecutor
+	>>> with ThreadPoolExecutor(2) as executor:
+	...     flatten_parallel(tree, executor=executor) == flatten_tree(tree)
+	True
+	>>> gen = lambda: (line for line in ['xxxx', 'yyyy'])
+	>>> with ThreadPoolExecutor(2) as executor:
+	...     flatten_parallel(['a', gen(), 'b', ['c'], 'd', ['e']], executor=executor) == flatten_tree(['a', gen(), 'b', ['c'], 'd', ['e']])
+	True
+	"""
+	if not node_is_block(tree):
+		return flatten_tree(tree)
+	# Counting a lazy block's lines would use it up, so they're guessed to have one line (for balancing),
+	# and don't count as known lines (which decide whether a chunk that rendered to '' is empty).
+	known_line_counts = [0 if node_is_lazy(node) else count_lines([node]) for node in tree]
+	line_counts = [1 if node_is_lazy(node) else count for (node, count) in zip(tree, known_line_counts)]
+	chunks = _balanced_chunks(line_counts, n_chunks=(workers or _os.cpu_count() or 1) * chunks_per_worker)
+	if len(chunks) <= 1:
+		return flatten_tree(tree)
+
+	if executor is not None:
+		rendered = executor.map(flatten_tree, [tree[start:stop] for (start, stop, _) in chunks])
+	else:
+		import concurrent.futures
+		import multiprocessing
+		if not getattr(_sys, '_is_gil_enabled', lambda: True)():
+			with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+				return flatten_parallel(tree, executor=executor, chunks_per_worker=chunks_per_worker)
+		elif 'fork' in multiprocessing.get_all_start_methods():
+			# With 'fork', the initializer's arguments are inherited by the workers instead of pickled,
+			# so each worker gets the tree for free, and keeps it in its own `_worker_tree`.
+			context = multiprocessing.get_context('fork')
+			with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_set_worker_tree, initargs=(tree,)) as executor:
+				rendered = list(executor.map(_flatten_worker_tree_slice, [start for (start, _, _) in chunks], [stop for (_, stop, _) in chunks]))
+		else:
+			with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+				return flatten_parallel(tree, executor=executor, chunks_per_worker=chunks_per_worker)
+
+	# A chunk that has no lines renders to '', but so does a chunk with a single empty line,
+	# so we need the line counts to know which ones to skip when joining.
+	# (A lazy block's lines are always indented, so if it has any, the chunk won't render to '')
+	return join_lines(
+		src for (src, (start, stop, _)) in zip(rendered, chunks)
+		if src or sum(known_line_counts[start:stop])
+	)
+
+
+# Only ever set in the worker processes of `flatten_parallel`, each one has its own
+_worker_tree = None
+
+def _set_worker_tree(tree: Tree) -> None:
+	global _worker_tree
+	_worker_tree = tree
+
+def _flatten_worker_tree_slice(start: int, stop: int) -> str:
+	return flatten_tree(_worker_tree[start:stop])
+
+
+def _balanced_chunks(line_counts: 'List[int]', n_chunks: int) -> 'List[Tuple[int, int, int]]':
+	"Splits nodes into at most `n_chunks` contiguous chunks with similar line counts. Returns `(start, stop, line_count)` triples."
+	target = max(sum(line_counts) / n_chunks, 1)
+	chunks = []
+	(start, n_lines) = (0, 0)
+	for (i, count) in enumerate(line_counts):
+		n_lines += count
+		if n_lines >= target:
+			chunks.append((start, i+1, n_lines))
+			(start, n_lines) = (i+1, 0)
+	if start < len(line_counts):
+		chunks.append((start, len(line_counts), n_lines))
+	return chunks
+
+
+def count_lines(tree: Tree) -> int:
+	"""
+	Returns the number of lines `tree` would render to.
+
+	>>> count_lines(['aaaa', ['bbbb', [], ['cccc']]])
+	3
+	>>> count_lines(['aaaa', [Snippet('bbbb\\ncccc')]])
+	3
+	"""
+	if not node_is_block(tree):
+		return sum(1 for _ in iter_lines_with_indent_level(tree))
+	# A faster walk than `iter_lines_with_indent_level`, since we don't care about the order.
+	count = 0
+	blocks = [tree]
+	while blocks:
+		for node in blocks.pop():
+			if node_is_line(node):
+				count += 1
+			elif node_is_block(node):
+				blocks.append(node)
+			elif type(node) is Snippet:
+				count += node.count('\n') + 1
+			elif node_is_deferred_line(node):
+				count += 1
+			else:
+				# lazy blocks (or garbage, which will raise an appropriate error)
+				return sum(1 for _ in iter_lines_with_indent_level(tree))
+	return count
+
+
+def tree_stats(tree: Tree, indent: bytes = b"\t", encoding: str = 'utf-8') -> 'Dict[str, int]':
+	"""
+	Returns some statistics about the tree, without rendering it:
+	- lines: the number of lines it renders to
+	- bytes: the size of the output, like `rendered_size`
+	- max_depth: how deeply its blocks are nested (a tree without blocks has depth 0)
+	- blocks: the number of blocks in it (not counting the tree itself)
+	- largest_block: the number of lines in the largest block
+
+	>>> tree_stats(['aaaa', ['bbbb', ['cccc'], 'dddd'], []])
+	{'lines': 4, 'bytes': 23, 'max_depth': 2, 'blocks': 3, 'largest_block': 3}
+	>>> from indented import rope
+	>>> tree_stats(['aaaa', [rope.Expr('x' * 300)]])
+	{'lines': 2, 'bytes': 306, 'max_depth': 1, 'blocks': 1, 'largest_block': 1}
+
+	Lazy blocks get expanded (and so used up, if they're iterators).
+	As in `rendered_size`, `indent` has to be encoded with `encoding`, and the encoding can't be a stateful one.
+	"""
+	_decode_indent(indent, encoding)
+	newline_size = len('\n'.encode(encoding))
+	ascii_compatible = ('a'.encode(encoding) == b'a')
+	(n_lines, size, max_depth, n_blocks, largest_block) = (0, 0, 0, 0, 0)
+	stack = [(iter(tree) if node_is_block(tree) else _LazyBlockIterator(tree).nodes, 0)] # (nodes left, n_lines when the block started)
+	while stack:
+		for node in stack[-1][0]:
+			if node_is_line(node):
+				n_lines += 1
+				size += len(indent) * (len(stack)-1) + (len(node) if ascii_compatible and node.isascii() else len(node.encode(encoding)))
+			elif node_is_block(node) or node_is_lazy(node):
+				stack.append((iter(node) if node_is_block(node) else _LazyBlockIterator(node).nodes, n_lines))
+				n_blocks += 1
+				max_depth = max(max_depth, len(stack)-1)
+				break
+			elif type(node) is Snippet:
+				n_snippet_lines = node.count('\n') + 1
+				n_lines += n_snippet_lines
+				size += len(indent) * (len(stack)-1) * n_snippet_lines + (len(node) if ascii_compatible and node.isascii() else len(node.encode(encoding)))
+				size -= newline_size * (n_snippet_lines - 1) # its newlines are in `len(node)`, but they'll get counted with the rest at the end
+			elif node_is_deferred_line(node):
+				line = node.__indented_line__()
+				n_lines += 1
+				size += len(indent) * (len(stack)-1) + (len(line) if ascii_compatible and line.isascii() else len(line.encode(encoding)))
+			else: raise TypeError('Expected Node, got {!r}: {!r}'.format(type(node).__qualname__, node))
+		else:
+			(_, start) = stack.pop()
+			if stack:
+				largest_block = max(largest_block, n_lines - start)
+	return {
+		'lines': n_lines,
+		'bytes': size + newline_size * max(n_lines - 1, 0),
+		'max_depth': max_depth,
+		'blocks': n_blocks,
+		'largest_block': largest_block,
+	}
+
+
+
+
+# Random access to lines
+
+class LineIndex:
+	"""
+	An index over a tree that allows getting single lines or slices of its rendered output
+	without rendering everything before them. For every block, it keeps the cumulative line counts
+	of the block's nodes, so a lookup only has to bisect its way down one path: O(depth + lines returned).
+	Building it takes one walk over the tree.
+
+	>>> tree = ['aaaa', ['bbbb', ['cccc'], 'dddd'], 'eeee']
+	>>> index = LineIndex(tree)
+	>>> len(index)
+	5
+	>>> index.line_at(2, indent_string='  ')
+	'    cccc'
+	>>> index.render_slice(1, 4, indent_string='  ')
+	['  bbbb', '    cccc', '  dddd']
+
+	The index doesn't watch the tree, so after changing the tree's structure, call `refresh()`.
+	Without it, lookups can return the wrong lines - they only check the blocks on their own path,
+	and raise a `LookupError` if one of those has been replaced or changed length.
+
+	>>> tree[1].insert(0, 'wwww')
+	>>> index.line_at(1)
+	Traceback (most recent call last):
+	  ...
+	LookupError: The tree has changed since the LineIndex was built, call refresh()
+	>>> index.refresh()
+	>>> index.line_at(1), len(index)
+	('\\twwww', 6)
+
+	Lazy blocks aren't supported, as counting their lines would use them up.
+	"""
+	__slots__ = ('tree', '_blocks')
+
+	def __init__(self, tree: Tree):
+		self.tree = tree
+		self._blocks = {} # id(block) -> (block, len(block), cumulative line counts - the number of lines before each node, and the total)
+		self.refresh()
+
+
+	def refresh(self) -> None:
+		"Rebuilds the index from scratch. Takes one walk over the tree."
+		if not node_is_block(self.tree):
+			raise TypeError('Expected a list, got {!r}: {!r}'.format(type(self.tree).__qualname__, self.tree))
+		blocks = {}
+		stack = [(self.tree, iter(self.tree), [0])]
+		while stack:
+			(block, nodes, counts) = stack[-1]
+			for node in nodes:
+				if node_is_line(node):
+					counts.append(counts[-1] + 1)
+				elif node_is_block(node):
+					stack.append((node, iter(node), [0]))
+					break
+				elif node_is_deferred_line(node) and type(node) is not Snippet:
+					counts.append(counts[-1] + 1)
+				else:
+					raise TypeError('LineIndex only supports lines and (non-lazy) blocks, got {!r}: {!r}'.format(type(node).__qualname__, node))
+			else:
+				stack.pop()
+				blocks[id(block)] = (block, len(block), _array('L', counts)) # keeping a reference to `block`, so its id can't get reused
+				if stack:
+					parent_counts = stack[-1][2]
+					parent_counts.append(parent_counts[-1] + counts[-1])
+		self._blocks = blocks
+
+
+	def __len__(self) -> int:
+		"The number of lines the tree renders to."
+		entry = self._entry(self.tree)
+		if entry is None:
+			raise _tree_changed()
+		return entry[2][-1]
+
+	def line_at(self, n: int, indent_string: str = "\t") -> str:
+		"Returns the `n`-th line of the output (negative `n` counts from the end, like for lists)."
+		path = self._path_to(n)
+		if path is None:
+			raise IndexError('line index out of range')
+		level = len(path) - 1
+		(block, i) = path[-1]
+		return indent_string * level + _line_text(block[i])
+
+	def render_slice(self, start: 'Optional[int]' = None, stop: 'Optional[int]' = None, indent_string: str = "\t") -> 'List[str]':
+		"Returns the indented lines `start` to `stop` of the output, like `indented_lines(tree)[start:stop]`."
+		(start, stop, _) = slice(start, stop).indices(len(self))
+		if start >= stop:
+			return []
+		n_lines = stop - start
+		indents = _IndentCache(indent_string)
+		out = []
+		stack = self._path_to(start) # [[block, index of the current node]], from the root down
+		# Continue the walk from there, same as `iter_lines_with_indent_level`
+		while stack:
+			frame = stack[-1]
+			(block, i) = frame
+			if i >= len(block):
+				stack.pop()
+				if stack:
+					stack[-1][1] += 1
+				continue
+			node = block[i]
+			if not node_is_block(node):
+				out.append(indents[len(stack)-1] + _line_text(node))
+				if len(out) == n_lines:
+					break
+				frame[1] += 1
+			else:
+				stack.append([node, 0])
+		return out
+
+
+	def _entry(self, block: 'List[Node]') -> 'Optional[tuple]':
+		"Returns the index entry for `block`, or None if it's missing or out of date."
+		entry = self._blocks.get(id(block))
+		if entry is None or entry[0] is not block or entry[1] != len(block):
+			return None
+		return entry
+
+	def _path_to(self, n: int) -> 'Optional[List[list]]':
+		"""
+		Returns the path to the `n`-th line, as a list of `[block, index]` pairs
+		(with the line at `block[index]` of the last one), or None if it's out of range.
+		"""
+		total = len(self)
+		if n < 0:
+			n += total
+		if not (0 <= n < total):
+			return None
+		path = self._locate(n)
+		if path is None:
+			raise _tree_changed()
+		return path
+
+	def _locate(self, n: int) -> 'Optional[List[list]]':
+		path = []
+		block = self.tree
+		while True:
+			entry = self._entry(block)
+			if entry is None:
+				return None
+			counts = entry[2]
+			i = _bisect_right(counts, n) - 1
+			path.append([block, i])
+			node = block[i]
+			n -= counts[i]
+			if node_is_block(node):
+				block = node
+			else:
+				return path if (n == 0 and counts[i+1] - counts[i] == 1) else None
+
+
+_line_text = lambda node: node if node_is_line(node) else node.__indented_line__()
+
+_tree_changed = lambda: LookupError('The tree has changed since the LineIndex was built, call refresh()')
+
+
+def line_at(tree: 'Union[Tree, LineIndex]', n: int, indent_string: str = "\t") -> str:
+	"""
+	Returns the `n`-th line of the rendered tree.
+	Builds a `LineIndex` if you don't pass one - for repeated lookups, make one and reuse it.
+
+	>>> line_at(['aaaa', ['bbbb']], 1)
+	'\\tbbbb'
+	"""
+	index = tree if isinstance(tree, LineIndex) else LineIndex(tree)
+	return index.line_at(n, indent_string)
+
+def render_slice(tree: 'Union[Tree, LineIndex]', start: 'Optional[int]' = None, stop: 'Optional[int]' = None, indent_string: str = "\t") -> 'List[str]':
+	"""
+	Returns the indented lines `start` to `stop` of the rendered tree.
+	Builds a `LineIndex` if you don't pass one - for repeated lookups, make one and reuse it.
+
+	>>> render_slice(['aaaa', ['bbbb', ['cccc']]], 1, indent_string='  ')
+	['  bbbb', '    cccc']
+	"""
+	index = tree if isinstance(tree, LineIndex) else LineIndex(tree)
+	return index.render_slice(start, stop, indent_string)
+
+
+
+
+# Flat representation
+
+class FlatText:
+	"""
+	A flat alternative to the nested `Text` format:
+	all the lines live in one list, and their indent levels in a parallel `array('H')`.
+	Appending, extending, concatenating and indenting don't have to
+	walk (or copy) any nested structure, and rendering is a single loop.
+
+	>>> t = FlatText.from_tree(['aaaa', ['bbbb', ['cccc']]])
+	>>> t
+	FlatText([(0, 'aaaa'), (1, 'bbbb'), (2, 'cccc')])
+	>>> t.append('dddd', 1)
+	>>> t + FlatText.from_tree(['eeee']).nest()
+	FlatText([(0, 'aaaa'), (1, 'bbbb'), (2, 'cccc'), (1, 'dddd'), (1, 'eeee')])
+	>>> t.to_tree()
+	['aaaa', ['bbbb', ['cccc'], 'dddd']]
+	>>> t.flatten(indent_string='  ')
+	'aaaa\\n  bbbb\\n    cccc\\n  dddd'
+
+	Note that empty blocks don't produce any lines, so they don't survive
+	a round trip through `FlatText`.
+	"""
+	__slots__ = ('lines', 'levels')
+
+	def __init__(self, lines: 'Optional[List[str]]' = None, levels: 'Optional[Iterable[int]]' = None):
+		self.lines  = lines if lines is not None else []
+		self.levels = _array('H', levels if levels is not None else ())
+		assert len(self.lines) == len(self.levels), 'got {} lines and {} indent levels'.format(len(self.lines), len(self.levels))
+
+
+	@classmethod
+	def from_tree(cls, tree: Tree, indent_level_offset: int = 0) -> 'FlatText':
+		flat = cls()
+		flat.extend_tree(tree, indent_level_offset)
+		return flat
+
+	def to_tree(self) -> Tree:
+		tree = []
+		blocks = [tree] # blocks[i] is the currently open block at indent level i
+		for (indent_level, line) in zip(self.levels, self.lines):
+			del blocks[indent_level+1:]
+			while len(blocks) <= indent_level:
+				block = []
+				blocks[-1].append(block)
+				blocks.append(block)
+			blocks[-1].append(line)
+		return tree
+
+
+	def append(self, line: str, indent_level: int = 0) -> None:
+		self.lines.append(line)
+		self.levels.append(indent_level)
+
+	def extend(self, other: 'FlatText', indent_level_offset: int = 0) -> None:
+		self.lines.extend(other.lines)
+		if indent_level_offset:
+			self.levels.extend(_shift_levels(other.levels, indent_level_offset))
+		else:
+			self.levels.extend(other.levels)
+
+	def extend_tree(self, tree: Tree, indent_level_offset: int = 0) -> None:
+		add_line  = self.lines.append
+		add_level = self.levels.append
+		if not node_is_block(tree):
+			for (indent_level, line) in iter_lines_with_indent_level(tree, indent_level_offset):
+				add_line(line)
+				add_level(indent_level)
+			return
+		# Same as going through `iter_lines_with_indent_level`, but without a generator in the way
+		indent_level = indent_level_offset
+		iterators = [iter(tree)]
+		while iterators:
+			for node in iterators[-1]:
+				if node_is_line(node):
+					add_line(node)
+					add_level(indent_level)
+				elif node_is_block(node):
+					iterators.append(iter(node))
+					indent_level += 1
+					break
+				elif node_is_lazy(node):
+					self.extend_tree(node, indent_level+1)
+				elif node_is_deferred_line(node):
+					add_line(node.__indented_line__())
+					add_level(indent_level)
+				else: raise TypeError('Expected Node, got {!r}: {!r}'.format(type(node).__qualname__, node))
+			else:
+				iterators.pop()
+				indent_level -= 1
+
+	def nest(self, by: int = 1) -> 'FlatText':
+		"Returns a copy indented by `by` levels (which may be negative, as long as no level goes below 0)."
+		return FlatText(self.lines[:], _shift_levels(self.levels, by))
+
+	def copy(self) -> 'FlatText':
+		return FlatText(self.lines[:], self.levels)
+
+	def __add__(self, other: 'FlatText') -> 'FlatText':
+		if not isinstance(other, FlatText):
+			return NotImplemented
+		return FlatText(self.lines + other.lines, self.levels + other.levels)
+
+	def __iadd__(self, other: 'FlatText') -> 'FlatText':
+		if not isinstance(other, FlatText):
+			return NotImplemented
+		self.extend(other)
+		return self
+
+
+	def __len__(self) -> int:
+		return len(self.lines)
+
+	def __iter__(self) -> 'Iterator[Tuple[int, str]]':
+		"Yields `(indent_level, line)` pairs, like `iter_lines_with_indent_level`."
+		return zip(self.levels, self.lines)
+
+	def __eq__(self, other) -> bool:
+		if not isinstance(other, FlatText):
+			return NotImplemented
+		return self.levels == other.levels and self.lines == other.lines
+
+	def __repr__(self) -> str:
+		return '{}({!r})'.format(type(self).__qualname__, list(self))
+
+
+	def indented_lines(self, indent_string: str = "\t") -> 'List[str]':
+		indents = _IndentCache(indent_string)
+		return [indents[indent_level] + line for (indent_level, line) in zip(self.levels, self.lines)]
+
+	def flatten(self, indent_string: str = "\t") -> str:
+		return join_lines(self.indented_lines(indent_string))
+
+
+def _shift_levels(levels: '_array', by: int) -> '_array':
+	return _array('H', map(by.__add__, levels))
+
+
+
+
+# Building text imperatively
+
+class TextBuilder:
+	"""
+	Builds text line by line, with `with` blocks for the indentation.
+	Everything goes into one `FlatText`, so no nested lists get created
+	(and there's nothing to splat).
+
+	>>> b = TextBuilder()
+	>>> with b.block('def f(x):'):
+	...     with b.block('if x:'):
+	...         b.line('return 1')
+	...     b.extend(['print(x)', 'return 0'])
+	>>> print(b.flatten(indent_string='  '))
+	def f(x):
+	  if x:
+	    return 1
+	  print(x)
+	  return 0
+	>>> b.to_tree()
+	['def f(x):', ['if x:', ['return 1'], 'print(x)', 'return 0']]
+
+	`block()` adds the head line right away, the indent is added by `with`.
+	A plain `with b:` just indents.
+	"""
+	__slots__ = ('text', 'indent_level')
+
+	def __init__(self, text: 'Optional[FlatText]' = None, indent_level: int = 0):
+		self.text = text if text is not None else FlatText()
+		self.indent_level = indent_level
+
+
+	def line(self, line: str) -> None:
+		self.text.lines.append(line)
+		self.text.levels.append(self.indent_level)
+
+	def lines(self, *lines: str) -> None:
+		self.text.lines.extend(lines)
+		self.text.levels.extend(itertools.repeat(self.indent_level, len(lines)))
+
+	def extend(self, tree: Tree) -> None:
+		"Adds a tree (in the nested format) at the current indent level."
+		self.text.extend_tree(tree, self.indent_level)
+
+	def block(self, head: 'Optional[str]' = None) -> 'TextBuilder':
+		"Use as `with b.block(head):`."
+		if head is not None:
+			self.line(head)
+		return self
+
+	def __enter__(self) -> 'TextBuilder':
+		self.indent_level += 1
+		return self
+
+	def __exit__(self, *exc_info) -> None:
+		self.indent_level -= 1
+
+
+	def __len__(self) -> int:
+		return len(self.text)
+
+	def to_tree(self) -> Tree:
+		return self.text.to_tree()
+
+	def indented_lines(self, indent_string: str = "\t") -> 'List[str]':
+		return self.text.indented_lines(indent_string)
+
+	def flatten(self, indent_string: str = "\t") -> str:
+		return self.text.flatten(indent_string)
+
+	def __repr__(self) -> str:
+		return '{}({!r}, indent_level={})'.format(type(self).__qualname__, self.text, self.indent_level)
+
+
+
+
+# Memoized rendering
+
+class RenderCache:
+	"""
+	An opt-in cache for trees that reuse the same block objects in many places
+	(like a body passed to `cond` several times) or get rendered many times.
+	A block gets cached (relative to its own indent level) when it's rendered for the second time,
+	and later occurences are spliced in by prepending the right indent.
+	(Caching every block the first time around would copy each line once for every block it's in,
+	which gets expensive for deep trees with nothing to reuse)
+	The whole tree passed in is always cached.
+	Pass it as `cache=...` to `flatten_tree`/`indented_lines`.
+
+	Blocks are keyed by identity, so a block must not be mutated
+	after it's been rendered with a cache - use `invalidate(block)` or `clear()` if it is.
+	The cache holds at most `max_lines` lines, evicting the least recently used blocks first.
+	Lazy blocks get expanded every time, and aren't cached - and neither are the blocks containing them,
+	since a lazy block can produce different nodes each time.
+
+	>>> body = ['return x']
+	>>> tree = ['if a:', body, 'elif b:', body]
+	>>> cache = RenderCache()
+	>>> flatten_tree(tree, cache=cache) == flatten_tree(tree)
+	True
+	>>> cache.hits, cache.misses
+	(0, 3)
+	>>> indented_lines(['while c:', body], cache=cache)
+	['while c:', '\\treturn x']
+	>>> cache.hits, cache.misses
+	(1, 4)
+	>>> indented_lines(tree, cache=cache)
+	['if a:', '\\treturn x', 'elif b:', '\\treturn x']
+	>>> cache.hits, cache.misses
+	(2, 4)
+	>>> flatten_tree(['a', lambda: ['b']], cache=cache)
+	'a\\n\\tb'
+	"""
+	__slots__ = ('max_lines', 'size', 'hits', 'misses', 'evictions', '_entries', '_seen')
+
+	def __init__(self, max_lines: int = 100000):
+		self.max_lines = max_lines
+		self.size = 0 # the number of cached lines
+		self.hits = self.misses = self.evictions = 0
+		self._entries = _OrderedDict() # (id(block), indent_string) -> (block, lines)
+		# Keys of the blocks rendered once (without a reference to the block - if its id gets reused,
+		# the worst that can happen is that another block gets cached the first time it's rendered)
+		self._seen = _OrderedDict() # (id(block), indent_string) -> None
+
+
+	def indented_lines(self, tree: Tree, indent_string: str = "\t") -> 'List[str]':
+		if node_is_lazy(tree):
+			tree = list(_LazyBlockIterator(tree).nodes)
+			n_lazy = 1 # don't cache the list
+		else:
+			cached = self._lookup(tree, indent_string)
+			if cached is not None:
+				return cached[:]
+			n_lazy = 0 # the number of lazy blocks expanded so far
+
+		indents = _IndentCache(indent_string)
+		out = []
+		indent_level = 0
+
+		# Same algorithm as `iter_lines_with_indent_level`, except the end-of-block marker
+		# is a tuple `(block, start, n_lazy)`, so we know which lines to put in the cache
+		# (unless a lazy block was expanded inside it).
+		# (Tuples aren't Nodes, so they can't be confused with anything from the input)
+		stack = []
+		stack.extend(reversed(tree))
+		BLOCK_START = object()
+		BLOCK_END = object() # for blocks that don't get cached
+		seen = self._seen
+
+		while stack:
+			node_or_block_marker = stack.pop()
+
+			if node_or_block_marker is BLOCK_START:
+				indent_level += 1
+
+			elif node_or_block_marker is BLOCK_END:
+				indent_level -= 1
+
+			elif type(node_or_block_marker) is tuple:
+				(block, start, n_lazy_at_start) = node_or_block_marker
+				if len(out) - start <= self.max_lines and n_lazy == n_lazy_at_start:
+					prefix_length = len(indents[indent_level])
+					self._store(block, indent_string, [line[prefix_length:] for line in out[start:]])
+				indent_level -= 1
+
+			elif node_is_line(node_or_block_marker):
+				out.append(indents[indent_level] + node_or_block_marker)
+
+			elif node_is_block(node_or_block_marker):
+				block = node_or_block_marker
+				cached = self._lookup(block, indent_string)
+				if cached is not None:
+					prefix = indents[indent_level+1]
+					out.extend([prefix + line for line in cached])
+				else:
+					key = (id(block), indent_string)
+					if key in seen:
+						del seen[key]
+						stack.append((block, len(out), n_lazy))
+					else:
+						seen[key] = None
+						if len(seen) > self.max_lines:
+							seen.popitem(last=False)
+						stack.append(BLOCK_END)
+					stack.extend(reversed(block))
+					stack.append(BLOCK_START)
+
+			elif node_is_lazy(node_or_block_marker):
+				n_lazy += 1
+				stack.append(BLOCK_END)
+				stack.extend(reversed(list(_LazyBlockIterator(node_or_block_marker).nodes)))
+				stack.append(BLOCK_START)
+
+			elif type(node_or_block_marker) is Snippet:
+				# Split into lines, so that the cached lines can be re-indented one by one
+				out.extend((indents[indent_level] + node_or_block_marker).split('\n'))
+
+			elif node_is_deferred_line(node_or_block_marker):
+				out.append(indents[indent_level] + node_or_block_marker.__indented_line__())
+
+			else:
+				unknown = node_or_block_marker
+				raise TypeError('Expected Node, got {!r}: {!r}'.format(type(unknown).__qualname__, unknown))
+
+		if not n_lazy:
+			self._store(tree, indent_string, out[:])
+		return out
+
+
+	def _lookup(self, block: Tree, indent_string: str) -> 'Optional[List[str]]':
+		key = (id(block), indent_string)
+		entry = self._entries.get(key)
+		if entry is not None and entry[0] is block:
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return entry[1]
+		else:
+			self.misses += 1
+			return None
+
+	def _store(self, block: Tree, indent_string: str, lines: 'List[str]') -> None:
+		if len(lines) > self.max_lines:
+			return
+		key = (id(block), indent_string)
+		old = self._entries.pop(key, None)
+		if old is not None:
+			self.size -= len(old[1])
+		self._entries[key] = (block, lines)
+		self.size += len(lines)
+		while self.size > self.max_lines:
+			(_, (_, evicted)) = self._entries.popitem(last=False)
+			self.size -= len(evicted)
+			self.evictions += 1
+
+
+	def invalidate(self, block: Tree) -> None:
+		for key in [key for key in self._entries if key[0] == id(block)]:
+			(_, lines) = self._entries.pop(key)
+			self.size -= len(lines)
+
+	def clear(self) -> None:
+		self._entries.clear()
+		self._seen.clear()
+		self.size = 0
+
+	def stats(self) -> 'Dict[str, int]':
+		return dict(
+			hits=self.hits, misses=self.misses, evictions=self.evictions,
+			blocks=len(self._entries), lines=self.size,
 		)
+
+	def __repr__(self) -> str:
+		return '{}(max_lines={!r}) <{}>'.format(type(self).__qualname__, self.max_lines, self.stats())
+
+
+
+
+# Instrumentation
+# (See `indented.instrument` for the public interface)
+
+# Reported to the render hooks after each instrumented call:
+# - function: 'flatten_tree', 'iter_lines_with_indent_level' or 'eval_def'
+# - seconds:  wall time spent in the function (for iterators - only the time spent producing the lines)
+# - lines:    lines produced (or compiled, for `eval_def`)
+# - chars:    characters produced (or compiled), not counting indentation for `iter_lines_with_indent_level`
+RenderEvent = _namedtuple('RenderEvent', ['function', 'seconds', 'lines', 'chars'])
+
+# Callables taking a `RenderEvent`. Checked with a single `if _render_hooks:`,
+# so when it's empty (the default) the instrumentation costs next to nothing.
+_render_hooks = [] # type: List[Callable[[RenderEvent], Any]]
+
+def _emit_render_event(event: RenderEvent) -> None:
+	for hook in _render_hooks:
+		hook(event)
+
+
+def _instrumented_flatten_tree(tree: Tree, cache: 'Optional[RenderCache]') -> str:
+	start = _time.perf_counter()
+	text = join_lines(iter_indented_lines(tree, cache=cache))
+	seconds = _time.perf_counter() - start
+	_emit_render_event(RenderEvent('flatten_tree', seconds, (text.count('\n') + 1) if text else 0, len(text)))
+	return text
+
+def _instrumented_iter_lines(tree: Tree, indent_level_offset: int) -> 'Iterator[Tuple[int, str]]':
+	clock = _time.perf_counter
+	(seconds, lines, chars) = (0.0, 0, 0)
+	iterator = _iter_lines_with_indent_level(tree, indent_level_offset)
+	try:
+		while True:
+			start = clock()
+			item = next(iterator, None)
+			seconds += clock() - start
+			if item is None:
+				break
+			lines += 1
+			chars += len(item[1])
+			yield item
+	finally:
+		# (also runs if the consumer stops early and the generator gets closed)
+		_emit_render_event(RenderEvent('iter_lines_with_indent_level', seconds, lines, chars))
+
+
+
+
+# "Recursive" version of the above - a different algorithm, useful for checking one against the other.
+# It's still shaped like the recursion (a block's lines get emitted right where the block is),
+# but the call stack is an explicit stack of child iterators, so arbitrarily deep trees are fine,
+# and all the lines go into one output list, so every line is copied exactly once.
+
+def indented_lines_rec(tree: Tree, indent_level: int = 0, indent_string: str = "\t") -> 'List[str]':
+	"""
+	>>> indented_lines_rec(['aaaa', ['bbbb', ['cccc']]], indent_string='  ')
+	['aaaa', '  bbbb', '    cccc']
+	"""
+	out = []
+	_extend_with_lines(out, tree, indent_level=indent_level, indent_string=indent_string)
+	return out
 	
 
 def _node_to_lines(node: Node, indent_level: int, indent_string: str) -> 'List[str]':
-	if node_is_line(node):
-		line = node
-		# print('node_to_lines :: line  | indent_level =', indent_level, ',', repr(line))
-		indent = indent_string * indent_level
-		return [indent + line]
-	elif node_is_block(node):
-		# print('node_to_lines :: block | indent_level =', indent_level, ', block =')
-		# pprint(node, indent=4)
-		nodes = node
-		return concat_lists(_node_to_lines(child, indent_level=indent_level+1, indent_string=indent_string) for child in nodes)
-	else: raise TypeError('Expected Node, got {!r}: {!r}'.format(type(node).__qualname__, node))
+	out = []
+	_extend_with_lines(out, [node], indent_level=indent_level, indent_string=indent_string)
+	return out
+
+
+def _extend_with_lines(out: 'List[str]', nodes: 'List[Node]', indent_level: int, indent_string: str) -> None:
+	indents = _IndentCache(indent_string)
+	add_line = out.append
+	indent = indents[indent_level]
+	iterators = [iter(nodes)] # one for each block we're in
+
+	while iterators:
+		for node in iterators[-1]:
+			if node_is_line(node):
+				line = node
+				add_line(indent + line)
+			elif node_is_block(node):
+				# "recurse" into the block. we'll come back to the current iterator when it's done
+				iterators.append(iter(node))
+				indent_level += 1
+				indent = indents[indent_level]
+				break
+			elif node_is_deferred_line(node):
+				add_line(indent + node.__indented_line__())
+			else: raise TypeError('Expected Node, got {!r}: {!r}'.format(type(node).__qualname__, node))
+		else:
+			# the innermost block is done - "return"
+			iterators.pop()
+			indent_level -= 1
+			indent = indents[indent_level]
 
 
 